@@ -0,0 +1,70 @@
+# Benchmark of the article chunker of the_conversation/processor.py (chunk_article()) against the divide_article() it replaced
+#
+# Usage: python benchmarks/bench_chunking.py [articles.jsonl ...]
+# Given JSON Lines files of The Conversation (e.g. the_conversation/data/articlesEdition/articles_uk.jsonl),
+# runs on their articles, otherwise on synthetic articles with paragraphs of the length of real ones
+import json
+import os
+import random
+import sys
+import time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'the_conversation'))
+from processor import chunk_article
+
+# Previous implementation, splitting each paragraph into a list of words, joining them back and copying the metadata for each sub-article
+def divide_article(d, threshold):
+    i = 1
+    text = []
+    for t in d['text']:
+        text += t.split(' ')
+        if len(text) >= threshold:
+            yield {
+                'id':'%s-%i'%(d['id'],i), 'url':d['url'], 'title':d['title'], 'date':d['date'],
+                'authors':' & '.join(d['authors']), 'edition':d['edition'], 'text':' '.join(text)}
+            i += 1
+            text = []
+    if len(text) > 0:
+            yield {
+                'id':'%s-%i'%(d['id'],i), 'url':d['url'], 'title':d['title'], 'date':d['date'],
+                'authors':' & '.join(d['authors']), 'edition':d['edition'], 'text':' '.join(text)}
+
+def synthetic_articles(n):
+    random.seed(0)
+    words = 'the study published in Nature found that adaptive policies do not always work as expected'.split()
+    return [{'id':str(i), 'url':'https://theconversation.com/article-%i'%i, 'title':'Article %i'%i, 'date':'2019-01-01',
+        'authors':['Jane Doe', 'John Smith'], 'edition':'UK',
+        'text':[' '.join(random.choices(words, k=random.randint(5, 120))) for _ in range(random.randint(5, 40))]}
+        for i in range(n)]
+
+def bench(name, divide, articles, repeat):
+    start = time.process_time()
+    for _ in range(repeat):
+        for d in articles:
+            divide(d)
+    per_article = (time.process_time() - start) / (repeat * len(articles)) * 1e6
+    print('%-50s %8.2f us/article'%(name, per_article))
+    return per_article
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        articles = []
+        for f in sys.argv[1:]:
+            with open(f, 'r', encoding='utf-8') as inFile:
+                articles += [json.loads(l) for l in inFile if l.strip() != '']
+    else:
+        articles = synthetic_articles(500)
+    print('%i articles, %i paragraphs'%(len(articles), sum(len(d['text']) for d in articles)))
+    thresholds = [300, 400]
+    for d in articles: # same sub-articles as the previous implementation
+        chunks = chunk_article(d, thresholds)
+        for t in thresholds:
+            assert chunks[t] == list(divide_article(d, t)), (d['id'], t)
+    for t in thresholds:
+        before = bench('threshold %i, divide_article()'%t, lambda d: list(divide_article(d, t)), articles, 5)
+        after = bench('threshold %i, chunk_article()'%t, lambda d: chunk_article(d, [t]), articles, 5)
+        print('%-50s %8.1fx'%('speed-up', before / after))
+    label = ', '.join(map(str, thresholds))
+    before = bench('thresholds %s, divide_article() per threshold'%label,
+        lambda d: [list(divide_article(d, t)) for t in thresholds], articles, 5)
+    after = bench('thresholds %s, chunk_article() single pass'%label, lambda d: chunk_article(d, thresholds), articles, 5)
+    print('%-50s %8.1fx'%('speed-up', before / after))
@@ -0,0 +1,62 @@
+# Benchmark of the CPU time spent parsing a research output page of a Pure portal,
+# comparing the full html.parser soup previously used to the parsers of common/parsing.py
+#
+# Usage: python benchmarks/bench_parsing.py [page.html ...]
+# Without pages, a synthetic page with the structure and size (~80 KB) of a Pure page is used
+import os
+import sys
+import time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from bs4 import BeautifulSoup
+from common.parsing import make_soup, make_strainer
+import common.parsing
+
+paper_strainer = make_strainer(['h1'], class_=['persons', 'rendering_abstractportal', 'status'])
+
+# Same lookups as get_paper() in the Pure scrapers
+def extract(soup):
+    title = soup.find('h1')
+    authors = soup.find(class_='persons')
+    abstract = soup.find(class_='rendering_abstractportal')
+    date = soup.find(class_='status').find(class_='date')
+    return [str(e) for e in [title, authors, abstract, date]]
+
+def synthetic_page():
+    head = ''.join('<script src="/js/%i.js"></script><link rel="stylesheet" href="/css/%i.css">'%(i,i) for i in range(40))
+    nav = ''.join('<li class="menu-item"><a href="/en/organisations/%i/">Organisation %i</a></li>'%(i,i) for i in range(300))
+    persons = ', '.join('<a rel="Person" href="/en/persons/p%i"><span>Author %i</span></a>'%(i,i) for i in range(12))
+    abstract = ' '.join(['Lorem ipsum dolor sit amet, consectetur adipiscing elit.']*40)
+    related = ''.join('<li class="list-result-item"><div class="result-container"><h3 class="title"><a href="/en/publications/%i"><span>Related output %i</span></a></h3>'
+        '<p class="type">Article</p><span class="date">%i Jan 2020</span></div></li>'%(i,i,i%28+1) for i in range(120))
+    return ('<!DOCTYPE html><html><head><title>Paper</title>%s</head><body><nav><ul>%s</ul></nav><main><div class="page-content">'
+        '<h1><span>A research output title</span></h1><p class="relations persons">%s</p>'
+        '<div class="rendering rendering_researchoutput rendering_abstractportal"><p>%s</p></div>'
+        '<table class="properties"><tr class="status"><th>Publication status</th><td><span class="date">3 Jan 2020</span></td></tr></table>'
+        '<ul class="list-results">%s</ul></div></main><footer>%s</footer></body></html>')%(head, nav, persons, abstract, related, nav)
+
+def bench(name, parse, pages, repeat):
+    for p in pages: # same content extracted as the baseline
+        assert extract(parse(p)) == extract(BeautifulSoup(p, 'html.parser')), name
+    start = time.process_time()
+    for _ in range(repeat):
+        for p in pages:
+            extract(parse(p))
+    per_page = (time.process_time() - start) / (repeat * len(pages)) * 1000
+    print('%-32s %8.2f ms/page'%(name, per_page))
+    return per_page
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        pages = [open(f, 'r', encoding='utf-8').read() for f in sys.argv[1:]]
+    else:
+        pages = [synthetic_page()]
+    print('%i page(s), %.0f KB on average (default parser: %s)'%(len(pages), sum(len(p) for p in pages)/len(pages)/1024, common.parsing.parser))
+    baseline = bench('html.parser, full soup', lambda p: BeautifulSoup(p, 'html.parser'), pages, 20)
+    for parser in ['html.parser', 'lxml']:
+        common.parsing.parser = parser
+        try:
+            bench('%s, full soup'%parser, lambda p: make_soup(p), pages, 20)
+            t = bench('%s, strained soup'%parser, lambda p: make_soup(p, paper_strainer), pages, 20)
+            print('%-32s %8.1fx'%('speed-up (strained)', baseline / t))
+        except Exception as e: # parser not installed
+            print('%s: %r'%(parser, e))
@@ -0,0 +1,56 @@
+# Benchmark of the text normaliser of common/text.py against the clean_html()/clean_text() functions it replaced
+#
+# Usage: python benchmarks/bench_text.py [articles.jsonl ...]
+# Given JSON Lines files of The Conversation (e.g. the_conversation/data/articlesEdition/articles_uk.jsonl),
+# runs on their paragraphs (as in scrap_article()) and article bodies (as in processor.py),
+# otherwise on synthetic articles with the quotes and markup of real ones
+import json
+import os
+import re
+import sys
+import time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common.text import normalise
+
+# Previous implementation, compiling its patterns and going through the text three times at each call
+def clean_html(text):
+    clean_tags = re.compile('<.*?>')
+    clean_whitespace = re.compile(r'\s+')
+    clean_quotation = re.compile('”|“|"|’|‘')
+    return re.sub(clean_whitespace, ' ',
+        re.sub(clean_quotation, ' ',
+        re.sub(clean_tags, ' ', text)))
+
+def synthetic_articles(n):
+    paragraph = ('The study, published in “Nature”, found that ‘adaptive’ policies don’t always work. '
+        'As one researcher said: "We need\tmore  data",  and   <em>more</em> time.\n')
+    return [[paragraph * (1 + i % 4) for _ in range(25)] for i in range(n)]
+
+def bench(name, clean, texts, repeat):
+    start = time.process_time()
+    for _ in range(repeat):
+        for t in texts:
+            clean(t)
+    per_text = (time.process_time() - start) / (repeat * len(texts)) * 1e6
+    print('%-40s %8.2f us/text'%(name, per_text))
+    return per_text
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        articles = []
+        for f in sys.argv[1:]:
+            with open(f, 'r', encoding='utf-8') as inFile:
+                articles += [json.loads(l)['text'] for l in inFile if l.strip() != '']
+    else:
+        articles = synthetic_articles(200)
+    paragraphs = [p for a in articles for p in a]
+    bodies = [' '.join(a) for a in articles]
+    markup = ['<p>%s</p>'%p for p in paragraphs]
+    print('%i articles, %i paragraphs'%(len(articles), len(paragraphs)))
+    for name, texts in [('paragraphs', paragraphs), ('article bodies', bodies), ('paragraphs with tags', markup)]:
+        for t in texts: # same result as the previous implementation
+            assert normalise(t) == clean_html(t), t
+            assert normalise(t, strip=True) == clean_html(t).strip(), t
+        before = bench('%s, clean_html()'%name, clean_html, texts, 5)
+        after = bench('%s, normalise()'%name, normalise, texts, 5)
+        print('%-40s %8.1fx'%('speed-up', before / after))
@@ -0,0 +1,130 @@
+import gzip
+import hashlib
+import json
+import os
+import threading
+
+# Default maximum size of the cache on disk (in bytes)
+default_max_bytes = 10 * 1024**3
+
+# On-disk cache of HTTP responses, used to revalidate pages when re-crawling a website.
+# Entries are addressed by the hash of their url and made of two files:
+# - <hash>.json: url, ETag and Last-Modified validators, and the results already parsed from the page;
+# - <hash>.html.gz: the page content.
+# Only pages served with a validator are stored, since the others cannot be revalidated.
+# When the cache grows over max_bytes, the least recently used entries are evicted.
+# Used by the Fetcher from several threads at once: writes, evictions, the size and stats are updated under a lock.
+class ResponseCache:
+    def __init__(self, directory, max_bytes=default_max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.stats = {'hits':0, 'misses':0, 'updates':0, 'parses_skipped':0, 'evicted':0}
+        self._lock = threading.RLock() # store() evicts while holding it
+        os.makedirs(directory, exist_ok=True)
+        self.size = sum(e.stat().st_size for e in self._entries())
+
+    def _entries(self):
+        for d in os.scandir(self.directory):
+            if d.is_dir():
+                yield from os.scandir(d.path)
+
+    def _path(self, url, ext):
+        h = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, h[:2], h+ext)
+
+    def _write(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._lock:
+            old_size = os.path.getsize(path) if os.path.exists(path) else 0
+            with open(path+'.tmp', 'wb') as outFile:
+                outFile.write(data)
+            os.replace(path+'.tmp', path) # readers never see a partial entry
+            self.size += len(data) - old_size
+
+    def _write_meta(self, meta):
+        self._write(self._path(meta['url'], '.json'), json.dumps(meta).encode('utf-8'))
+
+    # Returns the metadata of the cached url, or None if not cached
+    def lookup(self, url):
+        try:
+            with open(self._path(url, '.json'), 'r', encoding='utf-8') as inFile:
+                return json.load(inFile)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    # Returns the headers making a request conditional to the cached entry
+    def headers(self, meta):
+        headers = {}
+        if meta != None:
+            if meta['etag'] != None:
+                headers['If-None-Match'] = meta['etag']
+            if meta['last_modified'] != None:
+                headers['If-Modified-Since'] = meta['last_modified']
+        return headers
+
+    # Records the server confirmed the cached entry is up-to-date (HTTP 304)
+    def revalidated(self, meta):
+        with self._lock:
+            self.stats['hits'] += 1
+        try:
+            os.utime(self._path(meta['url'], '.json'))
+        except FileNotFoundError:
+            pass
+
+    # Returns the result of parse_name for the cached entry, or None if never parsed
+    def parsed(self, meta, parse_name):
+        result = meta['parsed'].get(parse_name)
+        if result != None:
+            with self._lock:
+                self.stats['parses_skipped'] += 1
+        return result
+
+    # Returns the cached page content, or None if it has been evicted
+    def text(self, url):
+        try:
+            with gzip.open(self._path(url, '.html.gz'), 'rt', encoding='utf-8') as inFile:
+                return inFile.read()
+        except FileNotFoundError:
+            return None
+
+    # Stores a newly fetched page, given its ETag and Last-Modified headers
+    def store(self, url, meta, text, etag, last_modified):
+        with self._lock:
+            self.stats['misses' if meta == None else 'updates'] += 1
+        if etag == None and last_modified == None:
+            return
+        self._write(self._path(url, '.html.gz'), gzip.compress(text.encode('utf-8')))
+        self._write_meta({'url':url, 'etag':etag, 'last_modified':last_modified, 'parsed':{}})
+        with self._lock:
+            if self.size > self.max_bytes:
+                self.evict()
+
+    # Stores the result parsed from a cached page, so it is not parsed again on a 304
+    def store_parsed(self, url, parse_name, result):
+        meta = self.lookup(url)
+        if meta != None:
+            meta['parsed'][parse_name] = result
+            try:
+                self._write_meta(meta)
+            except TypeError: # result cannot be saved as JSON
+                pass
+
+    # Removes the least recently used entries until the cache is 10% under its maximum size
+    def evict(self):
+        with self._lock:
+            metas = sorted((e for e in self._entries() if e.name.endswith('.json')), key=lambda e: e.stat().st_mtime)
+            for e in metas:
+                if self.size <= 0.9 * self.max_bytes:
+                    break
+                for path in [e.path, e.path[:-len('.json')]+'.html.gz']:
+                    try:
+                        self.size -= os.path.getsize(path)
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                self.stats['evicted'] += 1
+
+    def report(self):
+        print('Cache: %i hits (%i parses skipped), %i misses, %i updates, %i evicted, %.1f MB on disk'%(
+            self.stats['hits'], self.stats['parses_skipped'], self.stats['misses'], self.stats['updates'],
+            self.stats['evicted'], self.size / 1024**2))
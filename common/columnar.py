@@ -0,0 +1,101 @@
+import os
+import shutil
+
+# Parquet files are optional: they require pyarrow, the scrapers run without it
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+except ImportError:
+    pa = None
+
+# Columns with few distinct values, dictionary-encoded: each distinct value is stored once per row group,
+# and read back as a dictionary (categorical) array
+# (not the free-text columns such as authors, whose values are mostly distinct: a dictionary only makes them larger)
+dictionary_fields = ('edition', 'organisation', 'year')
+
+def _require_pyarrow():
+    if pa == None:
+        raise ImportError('pyarrow is required for Parquet files: pip install pyarrow')
+
+def _schema(fields, row, partitioning, dictionary):
+    types = []
+    for f in fields:
+        if isinstance(row.get(f), list):
+            types.append(pa.list_(pa.string()))
+        elif f in dictionary and f not in partitioning:
+            types.append(pa.dictionary(pa.int32(), pa.string()))
+        else:
+            types.append(pa.string())
+    return pa.schema(list(zip(fields, types)))
+
+def _batches(first, rows, schema, batch_size):
+    batch = [first]
+    for r in rows:
+        batch.append(r)
+        if len(batch) == batch_size:
+            yield pa.RecordBatch.from_pylist(batch, schema)
+            batch = []
+    if len(batch) > 0:
+        yield pa.RecordBatch.from_pylist(batch, schema)
+
+# Writes rows (dictionaries of strings, or of lists of strings) to a Parquet dataset, the directory path (replaced if it exists),
+# partitioned by the fields in partitioning (e.g. ('edition', 'year') -> path/edition=UK/year=2019/part-0.parquet)
+# so readers only open the files of the partitions they select.
+# The columns are fields or, if not given, the keys of the first row; the fields in dictionary are dictionary-encoded.
+# Rows are streamed by batches of batch_size rows, the row groups hold at most batch_size rows.
+# Returns the number of rows written
+def write_parquet(path, rows, partitioning=(), fields=None, dictionary=dictionary_fields, batch_size=10000):
+    _require_pyarrow()
+    rows = iter(rows)
+    first = next(rows, None)
+    if first == None:
+        return 0
+    schema = _schema(list(fields or first.keys()), first, partitioning, dictionary)
+    count = [0]
+    def counted():
+        for b in _batches(first, rows, schema, batch_size):
+            count[0] += b.num_rows
+            yield b
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    ds.write_dataset(counted(), path, schema=schema, format='parquet',
+        partitioning=ds.partitioning(pa.schema([schema.field(f).with_type(pa.string()) for f in partitioning]), flavor='hive'),
+        file_options=ds.ParquetFileFormat().make_write_options(use_dictionary=[f for f in schema.names if f in dictionary]),
+        max_rows_per_group=batch_size)
+    return count[0]
+
+# Names of the partition fields of a dataset, from its first directories (path/edition=UK/year=2019/...)
+def _partition_fields(path):
+    fields = []
+    while True:
+        dirs = sorted(e.name for e in os.scandir(path) if e.is_dir() and '=' in e.name)
+        if len(dirs) == 0:
+            return fields
+        fields.append(dirs[0].split('=', 1)[0])
+        path = os.path.join(path, dirs[0])
+
+# the partition fields are read back as dictionaries of strings too, as written
+# (not inferred from their values: year would be read as integers unless a year is empty)
+def _dataset(path):
+    schema = pa.schema([(f, pa.dictionary(pa.int32(), pa.string())) for f in _partition_fields(path)])
+    return ds.dataset(path, format='parquet', partitioning=ds.partitioning(schema, flavor='hive', dictionaries='infer'))
+
+def _filter(filters):
+    expression = None
+    for f, values in (filters or {}).items():
+        e = ds.field(f).isin(list(values))
+        expression = e if expression is None else expression & e # expressions override ==
+    return expression
+
+# Returns a pyarrow Table of a Parquet dataset written by write_parquet(), only the columns given (all if None)
+# and the rows whose fields hold one of the values given in filters, e.g. {'edition':['UK','US'], 'year':['2019']}:
+# filters on partition fields skip the other partitions' files, the others skip the row groups without these values
+def read_table(path, columns=None, filters=None):
+    _require_pyarrow()
+    return _dataset(path).to_table(columns=columns, filter=_filter(filters))
+
+# Yields the rows of a Parquet dataset as dictionaries (see read_table()), batch by batch
+def read_parquet(path, columns=None, filters=None):
+    _require_pyarrow()
+    for b in _dataset(path).to_batches(columns=columns, filter=_filter(filters)):
+        yield from b.to_pylist()
@@ -0,0 +1,160 @@
+import os
+import sqlite3
+
+# Corpus of the documents scraped, saved in an SQLite file shared by the scrapers, so the corpus is queried
+# (by edition, year, organisation...) through indexes instead of reading and rewriting whole files.
+# Tables:
+# - articles: articles of The Conversation, one row per article and edition (an article can be published in several);
+# - papers: research outputs of the universities, one row per url;
+# - authors: authors of the universities;
+# - paper_authors: authors linked to each paper, in the order they were recorded.
+# The year of the articles and papers is stored and indexed with their edition or organisation.
+# With fts, the titles and texts of the articles and the titles and abstracts of the papers are indexed for full-text search
+# (SQLite FTS5), kept up to date by triggers; the index is built from the rows already stored when first enabled.
+class CorpusStore:
+    def __init__(self, path, fts=False, batch_size=10000):
+        self.path = path
+        self.batch_size = batch_size
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.db = sqlite3.connect(path, timeout=60) # the university scrapers write from several threads
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS articles (id TEXT, edition TEXT, url TEXT, title TEXT, date TEXT, year TEXT,
+                authors TEXT, text TEXT, PRIMARY KEY (id, edition));
+            CREATE INDEX IF NOT EXISTS articles_url ON articles (url);
+            CREATE INDEX IF NOT EXISTS articles_date ON articles (date);
+            CREATE INDEX IF NOT EXISTS articles_edition_year ON articles (edition, year);
+            CREATE TABLE IF NOT EXISTS papers (url TEXT PRIMARY KEY, title TEXT, authors TEXT, date TEXT, year TEXT,
+                abstract TEXT, organisation TEXT);
+            CREATE INDEX IF NOT EXISTS papers_date ON papers (date);
+            CREATE INDEX IF NOT EXISTS papers_organisation_year ON papers (organisation, year);
+            CREATE TABLE IF NOT EXISTS authors (id TEXT PRIMARY KEY, name TEXT, url TEXT, organisation TEXT);
+            CREATE INDEX IF NOT EXISTS authors_url ON authors (url);
+            CREATE INDEX IF NOT EXISTS authors_organisation ON authors (organisation);
+            CREATE TABLE IF NOT EXISTS paper_authors (url TEXT, author_id TEXT, UNIQUE (url, author_id));
+            CREATE INDEX IF NOT EXISTS paper_authors_author ON paper_authors (author_id);
+        ''')
+        if fts:
+            self._create_fts('articles', ['title', 'text'])
+            self._create_fts('papers', ['title', 'abstract'])
+
+    def _create_fts(self, table, columns):
+        if self.db.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (table+'_fts', )).fetchone() != None:
+            return
+        cols = ', '.join(columns)
+        new = ', '.join('new.'+c for c in columns)
+        old = ', '.join('old.'+c for c in columns)
+        with self.db:
+            self.db.executescript('''
+                CREATE VIRTUAL TABLE {t}_fts USING fts5({cols}, content='{t}', content_rowid='rowid');
+                CREATE TRIGGER {t}_fts_insert AFTER INSERT ON {t} BEGIN
+                    INSERT INTO {t}_fts (rowid, {cols}) VALUES (new.rowid, {new});
+                END;
+                CREATE TRIGGER {t}_fts_delete AFTER DELETE ON {t} BEGIN
+                    INSERT INTO {t}_fts ({t}_fts, rowid, {cols}) VALUES ('delete', old.rowid, {old});
+                END;
+                CREATE TRIGGER {t}_fts_update AFTER UPDATE ON {t} BEGIN
+                    INSERT INTO {t}_fts ({t}_fts, rowid, {cols}) VALUES ('delete', old.rowid, {old});
+                    INSERT INTO {t}_fts (rowid, {cols}) VALUES (new.rowid, {new});
+                END;
+                INSERT INTO {t}_fts ({t}_fts) VALUES ('rebuild');
+            '''.format(t=table, cols=cols, new=new, old=old))
+
+    # Inserts or updates rows, given as tuples, in transactions of batch_size rows
+    # If rows raises (e.g. a crawl interrupted), the rows read before are still saved
+    def _upsert(self, query, rows):
+        n = 0
+        batch = []
+        try:
+            for r in rows:
+                batch.append(r)
+                if len(batch) == self.batch_size:
+                    with self.db:
+                        self.db.executemany(query, batch)
+                    n += len(batch)
+                    batch = []
+        finally:
+            with self.db:
+                self.db.executemany(query, batch)
+            n += len(batch)
+        return n
+
+    # Inserts or updates articles (as scraped: text as a list of paragraphs, authors as a list), returns their number
+    def upsert_articles(self, articles):
+        return self._upsert('''INSERT INTO articles VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (id, edition) DO UPDATE SET
+            url = excluded.url, title = excluded.title, date = excluded.date, year = excluded.year,
+            authors = excluded.authors, text = excluded.text''',
+            ((a['id'], a['edition'], a['url'], a['title'], a['date'], a['date'][:4], ' & '.join(a['authors']), '\n'.join(a['text']))
+                for a in articles))
+
+    # Inserts or updates papers, with their authors: the id in 'author_id' (rows of the raw papers files)
+    # or the ids concatenated in 'author_ids' (rows of the papers files), returns the number of rows read
+    # The papers of several authors are stored once, and linked to all their authors
+    def upsert_papers(self, papers):
+        links = []
+        def rows():
+            for p in papers:
+                ids = [p['author_id']] if 'author_id' in p else [i for i in p.get('author_ids', '').split(' & ') if i != '']
+                links.extend((p['url'], i) for i in ids)
+                yield (p['url'], p['title'], p['authors'], p['date'], p['date'] if p['date'].isdigit() else '',
+                    p['abstract'], p['organisation'])
+        n = self._upsert('''INSERT INTO papers VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (url) DO UPDATE SET
+            title = excluded.title, authors = excluded.authors, date = excluded.date, year = excluded.year,
+            abstract = excluded.abstract, organisation = excluded.organisation''', rows())
+        self._upsert('INSERT OR IGNORE INTO paper_authors VALUES (?, ?)', links)
+        return n
+
+    # Inserts or updates authors (rows of the authors files), returns their number
+    def upsert_authors(self, authors):
+        return self._upsert('''INSERT INTO authors VALUES (?, ?, ?, ?) ON CONFLICT (id) DO UPDATE SET
+            name = excluded.name, url = excluded.url, organisation = excluded.organisation''',
+            ((a['id'], a['name'], a['url'], a['organisation']) for a in authors))
+
+    def _where(self, conditions):
+        clauses = []
+        params = []
+        for column, values in conditions:
+            if values != None:
+                values = list(values)
+                clauses.append('%s IN (%s)'%(column, ', '.join('?'*len(values))))
+                params += values
+        return (' WHERE '+' AND '.join(clauses) if clauses else ''), params
+
+    # Yields the articles of editions and years (all if None), as scraped (i.e. as in the JSON Lines files)
+    def articles(self, editions=None, years=None):
+        where, params = self._where([('edition', editions), ('year', years)])
+        query = 'SELECT url, title, date, id, text, authors, edition FROM articles'+where+' ORDER BY edition, rowid'
+        for url, title, date, id, text, authors, edition in self.db.execute(query, params):
+            yield {'url':url, 'title':title, 'date':date, 'id':id, 'text':text.split('\n') if text != '' else [],
+                'authors':authors.split(' & ') if authors != '' else [], 'edition':edition}
+
+    # Returns the number of articles by edition and year
+    def count_articles(self):
+        return {(e, y):n for e, y, n in self.db.execute('SELECT edition, year, COUNT(*) FROM articles GROUP BY edition, year')}
+
+    # Returns the ids of the articles stored more than once (i.e. in several editions), with their number
+    def duplicate_articles(self):
+        return self.db.execute('SELECT id, COUNT(*) FROM articles GROUP BY id HAVING COUNT(*) > 1').fetchall()
+
+    # Yields the papers of organisations and years (all if None), with the ids of their authors in 'author_ids'
+    # (i.e. as in the papers files)
+    def papers(self, organisations=None, years=None):
+        where, params = self._where([('organisation', organisations), ('year', years)])
+        query = '''SELECT title, authors, date, abstract, url, organisation,
+            (SELECT group_concat(author_id, ' & ') FROM (SELECT author_id FROM paper_authors pa WHERE pa.url = p.url ORDER BY rowid))
+            FROM papers p'''+where+' ORDER BY rowid'
+        keys = ['title', 'authors', 'date', 'abstract', 'url', 'organisation', 'author_ids']
+        for r in self.db.execute(query, params):
+            yield dict(zip(keys, r[:-1] + (r[-1] or '', )))
+
+    # Returns the articles or papers (table) matching an FTS5 query (e.g. 'climate NEAR(policy)'), best matches first
+    # Requires the store to be opened once with fts
+    def search(self, query, table='articles', limit=100):
+        cursor = self.db.execute('SELECT t.* FROM {t}_fts JOIN {t} t ON t.rowid = {t}_fts.rowid WHERE {t}_fts MATCH ? ORDER BY rank LIMIT ?'
+            .format(t=table), (query, limit))
+        keys = [c[0] for c in cursor.description]
+        return [dict(zip(keys, r)) for r in cursor]
+
+    def close(self):
+        self.db.close()
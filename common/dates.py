@@ -0,0 +1,88 @@
+import re
+from collections import Counter
+from datetime import date
+
+# Regular expressions of the strptime directives supported by DateParser
+_directives = {
+    'Y':r'(?P<Y>\d{4})', 'y':r'(?P<y>\d{2})', 'm':r'(?P<m>\d{1,2})', 'd':r'(?P<d>\d{1,2})',
+    'b':r'(?P<b>[A-Za-z]{3})', 'B':r'(?P<B>[A-Za-z]+)',
+    'H':r'\d{1,2}', 'I':r'\d{1,2}', 'M':r'\d{2}', 'S':r'\d{2}', 'p':r'[AaPp][Mm]', 'Z':r'[A-Za-z]+',
+    '%':'%'}
+_months = ['january', 'february', 'march', 'april', 'may', 'june', 'july', 'august', 'september', 'october', 'november', 'december']
+_month_numbers = {**{m:i+1 for i, m in enumerate(_months)}, **{m[:3]:i+1 for i, m in enumerate(_months)}}
+
+# Compiles a strptime format (e.g. '%d %b %Y') into a regular expression matching the whole string
+def _compile(fmt):
+    pattern = ''
+    i = 0
+    while i < len(fmt):
+        if fmt[i] == '%':
+            pattern += _directives[fmt[i+1]]
+            i += 2
+        else:
+            pattern += r'\s+' if fmt[i].isspace() else re.escape(fmt[i])
+            i += 1
+    return re.compile(pattern)
+
+def _date(groups):
+    if 'Y' in groups:
+        year = int(groups['Y'])
+    else:
+        year = int(groups['y'])
+        year += 1900 if year >= 69 else 2000 # same pivot as strptime
+    month = groups.get('m') or _month_numbers.get((groups.get('b') or groups.get('B') or '').lower())
+    if month == None and ('b' in groups or 'B' in groups):
+        raise ValueError('unknown month')
+    return date(year, int(month or 1), int(groups.get('d') or 1))
+
+# Returns the shape of a date not recognised, e.g. 'Spring 2020' -> 'A 9999', to count the formats not supported
+def _shape(text):
+    return re.sub(r'\d', '9', re.sub(r'[^\W\d_]+', 'A', text))
+
+# Parses the dates of a website given its formats (strptime syntax, only dates are read: times and time zones are ignored),
+# without strptime and its exceptions: each format is compiled once into a regular expression.
+# The format that matched last is tried first, so dates in the usual format of the website cost one match.
+# Dates in none of the formats are counted by shape, see report().
+class DateParser:
+    def __init__(self, formats):
+        self.formats = formats
+        self.patterns = [_compile(f) for f in formats]
+        self.last = 0
+        self.unrecognised = Counter()
+        self.examples = {}
+
+    # Returns the datetime.date of text, None if empty (or None) or in none of the formats
+    def parse(self, text):
+        if not text:
+            return None
+        for i in [self.last] + [i for i in range(len(self.patterns)) if i != self.last]:
+            m = self.patterns[i].fullmatch(text)
+            if m != None:
+                try:
+                    d = _date(m.groupdict())
+                except ValueError: # e.g. 31/02, or a word that is not a month
+                    continue
+                self.last = i
+                return d
+        shape = _shape(text)
+        self.unrecognised[shape] += 1
+        self.examples.setdefault(shape, text)
+        return None
+
+    # Prints the number of dates not recognised, by shape
+    def report(self, name='dates'):
+        if len(self.unrecognised) == 0:
+            return
+        print('Unrecognised %s: %i, in %i formats'%(name, sum(self.unrecognised.values()), len(self.unrecognised)))
+        for shape, n in self.unrecognised.most_common(10):
+            print('  %6i %s (e.g. %r)'%(n, shape, self.examples[shape]))
+
+# Publication dates of the university scrapers (Pure portals, Glasgow ePrints, Stirling)
+# They are converted to years in the crawling process rather than in the parsing processes,
+# so the dates in an unrecognised format are counted in one place and reported at the end of the run (paper_dates.report())
+paper_dates = DateParser(['%Y', '%b %Y', '%d %b %Y', '%d %B %Y', '%d/%m/%y'])
+
+# Returns the year of a publication date, the date itself if it is not recognised
+def parse_year(date):
+    d = paper_dates.parse(date)
+    return d.strftime('%Y') if d != None else date
@@ -0,0 +1,64 @@
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+# Dead-letter store of the urls a crawl failed to fetch or parse, saved in an SQLite file.
+# Each url is recorded with the parsing function (and arguments) it was fetched for,
+# the last exception, the HTTP status if the server answered (None for network errors), and its number of failures.
+# Urls fetched successfully later on (e.g. when replaying them) are removed from the store.
+# Used by the Fetcher from several threads at once.
+class DeadLetterStore:
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS failed (url TEXT PRIMARY KEY, parse TEXT, args TEXT,
+            status INTEGER, error TEXT, failures INTEGER, failed_at TEXT)''')
+        self._lock = threading.Lock()
+        self._failed = {r[0] for r in self.db.execute('SELECT url FROM failed')}
+        self.stats = {'failed':0, 'recovered':0}
+
+    # Records a failed url, given the name and arguments of the parsing function, the exception and the HTTP status
+    def record(self, url, parse_name, args, error, status):
+        with self._lock, self.db:
+            self.db.execute('''INSERT INTO failed VALUES (?, ?, ?, ?, ?, 1, ?) ON CONFLICT (url) DO UPDATE SET
+                parse = excluded.parse, args = excluded.args, status = excluded.status, error = excluded.error,
+                failures = failures + 1, failed_at = excluded.failed_at''',
+                (url, parse_name, json.dumps(args), status, '%s: %s'%(type(error).__name__, error), datetime.now().isoformat(timespec='seconds')))
+            self._failed.add(url)
+            self.stats['failed'] += 1
+
+    # Removes a url fetched successfully, if it had failed before
+    def resolved(self, url):
+        if url not in self._failed:
+            return
+        with self._lock, self.db:
+            self.db.execute('DELETE FROM failed WHERE url = ?', (url, ))
+            self._failed.discard(url)
+            self.stats['recovered'] += 1
+
+    # Returns the failed urls, only those fetched for parse_name (and args, given as a list) if given
+    def urls(self, parse_name=None, args=None):
+        query = 'SELECT url, parse, args FROM failed ORDER BY rowid'
+        with self._lock:
+            rows = self.db.execute(query).fetchall()
+        return [u for u, p, a in rows if (parse_name == None or p == parse_name) and (args == None or json.loads(a) == args)]
+
+    # Returns the failed records, as dictionaries
+    def failures(self):
+        with self._lock:
+            cursor = self.db.execute('SELECT * FROM failed ORDER BY rowid')
+            keys = [c[0] for c in cursor.description]
+            return [dict(zip(keys, r)) for r in cursor]
+
+    def report(self):
+        with self._lock:
+            statuses = self.db.execute('SELECT status, COUNT(*) FROM failed GROUP BY status ORDER BY status').fetchall()
+        print('Dead letters: %i failures, %i recovered, %i urls left in %s%s'%(self.stats['failed'], self.stats['recovered'],
+            len(self._failed), self.path, ' (%s)'%', '.join('%s: %i'%(s or 'network error', n) for s, n in statuses) if statuses else ''))
+
+    def close(self):
+        self.db.close()
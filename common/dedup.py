@@ -0,0 +1,96 @@
+import csv
+import json
+import os
+import sqlite3
+import tempfile
+from common.sinks import write_csv
+
+# Merges rows sharing the same value in field key, in a single pass over the rows.
+# Returns the number of rows read and an iterator over the merged rows, in order of first appearance:
+# each merged row is the first row of its group where join_field is replaced by joined_field,
+# the values of join_field of all the rows of the group concatenated with sep.
+# Rows can be read from a file (e.g. csv.DictReader), only the merged rows are held:
+# in a dictionary, or with on_disk in a temporary SQLite file for inputs too large for memory.
+def merge_duplicates(rows, key, join_field=None, joined_field=None, sep=' & ', on_disk=False):
+    if on_disk:
+        return _merge_on_disk(rows, key, join_field, joined_field, sep)
+    groups = {}
+    n_rows = 0
+    for r in rows:
+        n_rows += 1
+        group = groups.get(r[key])
+        if group == None:
+            groups[r[key]] = group = [r, []]
+        if join_field != None:
+            group[1].append(r[join_field])
+    return n_rows, (_merged(r, join_field, joined_field, sep.join(joined)) for r, joined in groups.values())
+
+def _merged(row, join_field, joined_field, joined):
+    if join_field == None:
+        return row
+    row = {k:v for k,v in row.items() if k != join_field}
+    row[joined_field] = joined
+    return row
+
+def _merge_on_disk(rows, key, join_field, joined_field, sep):
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    db = sqlite3.connect(path)
+    db.execute('PRAGMA journal_mode=OFF')
+    db.execute('PRAGMA synchronous=OFF')
+    db.execute('CREATE TABLE groups (key TEXT PRIMARY KEY, row TEXT, joined TEXT)')
+    n_rows = 0
+    for r in rows:
+        n_rows += 1
+        if join_field == None:
+            db.execute('INSERT OR IGNORE INTO groups VALUES (?, ?, NULL)', (r[key], json.dumps(r)))
+        else:
+            db.execute('''INSERT INTO groups VALUES (?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET joined = joined || ? || excluded.joined''', (r[key], json.dumps(r), r[join_field], sep))
+    db.commit()
+    def merged():
+        try:
+            for row, joined in db.execute('SELECT row, joined FROM groups ORDER BY rowid'):
+                yield _merged(json.loads(row), join_field, joined_field, joined)
+        finally:
+            db.close()
+            os.remove(path)
+    return n_rows, merged()
+
+# Merges new rows into a CSV file of rows already merged by merge_duplicates(), without merging all rows again:
+# the values of join_field of the new rows are added to joined_field of the row with the same key (if not there yet),
+# and the rows with a new key are added at the end of the file.
+# The file is only rewritten (in a single pass) if rows already in the file change, otherwise new rows are appended.
+# Returns the number of rows updated and added.
+def merge_into_csv(path, rows, key, join_field=None, joined_field=None, sep=' & '):
+    _, merged = merge_duplicates(rows, key, join_field, joined_field, sep)
+    new = {r[key]:r for r in merged}
+    if len(new) == 0:
+        return 0, 0
+    if not os.path.exists(path):
+        with open(path, 'w', encoding='utf-8', newline='') as outFile:
+            return 0, write_csv(outFile, new.values())
+    with open(path, 'r', encoding='utf-8', newline='') as inFile:
+        reader = csv.DictReader(inFile)
+        fields = reader.fieldnames
+        existing = [r[key] for r in reader if r[key] in new]
+    if len(existing) == 0:
+        with open(path, 'a', encoding='utf-8', newline='') as outFile:
+            csv.DictWriter(outFile, fields, quoting=csv.QUOTE_ALL).writerows(new.values())
+        return 0, len(new)
+    n_updated = 0
+    with open(path, 'r', encoding='utf-8', newline='') as inFile, open(path+'.tmp', 'w', encoding='utf-8', newline='') as outFile:
+        w = csv.DictWriter(outFile, fields, quoting=csv.QUOTE_ALL)
+        w.writeheader()
+        for r in csv.DictReader(inFile):
+            update = new.pop(r[key], None)
+            if update != None and join_field != None:
+                joined = r[joined_field].split(sep) if r[joined_field] != '' else []
+                added = [v for v in update[joined_field].split(sep) if v not in joined]
+                if len(added) > 0:
+                    r[joined_field] = sep.join(joined + added)
+                    n_updated += 1
+            w.writerow(r)
+        w.writerows(new.values())
+    os.replace(path+'.tmp', path) # readers never see a partial file
+    return n_updated, len(new)
@@ -0,0 +1,270 @@
+import asyncio
+import atexit
+import multiprocessing as mp
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import urlsplit
+import aiohttp
+from common.throttle import HostThrottle, parse_retry_after, backoff_delay, retry_statuses
+
+# Default number of requests in flight, in total and for a single host
+default_limit = 100
+default_limit_per_host = 8
+# Default number of seconds an idle connection is kept open for reuse
+default_keepalive_timeout = 60
+# Default number of requests started per second for a single host
+default_rate_per_host = 20
+# Default number of retries of a failed request, and delays (in seconds) of the exponential backoff between them
+default_retries = 5
+default_backoff = 1
+default_max_backoff = 60
+
+# Shared asynchronous HTTP engine.
+# An asyncio event loop runs in a background thread and holds a single aiohttp session,
+# so connections are kept alive and reused from one call to the next,
+# while the scripts keep calling it like a blocking function.
+# Pages are parsed in a persistent pool of processes (forked once, before the loop thread starts),
+# so the number of requests in flight is set by the limits and not by the number of CPUs.
+# With a ResponseCache, pages already seen are revalidated with conditional requests,
+# and the result parsed from a page is reused as long as the server answers it has not changed.
+# Requests to each host go through a HostThrottle (rate limit and adaptive concurrency, see throttle.py):
+# network errors, timeouts and 429/5xx statuses are retried with exponential backoff (following Retry-After if sent),
+# other error statuses raise aiohttp.ClientResponseError.
+# With a DeadLetterStore, the urls failing in imap, imap_urls and map are recorded to be replayed later.
+class Fetcher:
+    def __init__(self, limit=default_limit, limit_per_host=default_limit_per_host, keepalive_timeout=default_keepalive_timeout,
+            parse_workers=None, timeout=60, cache=None, rate_per_host=default_rate_per_host,
+            retries=default_retries, backoff=default_backoff, max_backoff=default_max_backoff, dead_letters=None):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.rate_per_host = rate_per_host
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._throttles = {} # host -> HostThrottle, only used on the loop
+        self.parse_workers = mp.cpu_count() if parse_workers == None else parse_workers
+        self.timeout = timeout
+        self.cache = cache
+        self.dead_letters = dead_letters
+        self._executor = None
+        if self.parse_workers > 0:
+            # forked now, while this is the only thread: a child forked later would inherit locks held by the other threads
+            # (the first task makes the pool fork all its processes)
+            self._executor = ProcessPoolExecutor(self.parse_workers, mp_context=mp.get_context('fork'))
+            self._executor.submit(os.getpid).result()
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+        self._session = self._run(self._open_session())
+        atexit.register(self.close)
+
+    async def _open_session(self):
+        connector = aiohttp.TCPConnector(limit=self.limit, limit_per_host=self.limit_per_host,
+            keepalive_timeout=self.keepalive_timeout)
+        return aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout))
+
+    # Runs a coroutine on the engine's loop and waits for its result
+    def _run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    # Returns the status, text (None on a 304), ETag and Last-Modified of the response
+    # Retries transient failures, raises the last error once out of retries
+    async def _fetch(self, url, headers=None):
+        host = urlsplit(url).netloc
+        if host not in self._throttles:
+            self._throttles[host] = HostThrottle(self.rate_per_host, self.limit_per_host)
+        throttle = self._throttles[host]
+        attempt = 0
+        while True:
+            await throttle.acquire()
+            start = time.monotonic()
+            status = None
+            retry_after = None
+            try:
+                async with self._session.get(url, headers=headers) as response:
+                    status = response.status
+                    if status not in retry_statuses:
+                        response.raise_for_status()
+                        text = None if status == 304 else await response.text()
+                        throttle.success(time.monotonic() - start)
+                        return status, text, response.headers.get('ETag'), response.headers.get('Last-Modified')
+                    retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                    response.raise_for_status()
+            except aiohttp.ClientResponseError as e:
+                error = e
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                status = None
+                error = e
+            finally:
+                await throttle.release()
+            retried = attempt < self.retries and (status == None or status in retry_statuses)
+            throttle.failure(status, retry_after, retried)
+            if not retried:
+                raise error
+            await asyncio.sleep(max(retry_after or 0, backoff_delay(attempt, self.backoff, self.max_backoff)))
+            attempt += 1
+
+    # Starts fetching url, with a conditional request if it is cached (meta)
+    def _submit(self, url, meta):
+        headers = self.cache.headers(meta) if self.cache != None else None
+        return asyncio.run_coroutine_threadsafe(self._fetch(url, headers), self._loop)
+
+    # Returns the page text given a response, from the cache on a 304
+    # None if the cached text was evicted in the meantime
+    def _page(self, url, meta, response):
+        status, text, etag, last_modified = response
+        if self.cache == None:
+            return text
+        if status == 304 and meta != None:
+            self.cache.revalidated(meta)
+            return self.cache.text(url)
+        if status == 200:
+            self.cache.store(url, meta, text, etag, last_modified)
+        return text
+
+    # Submits parse(url, text, *args) to the parsing processes, or runs it here if there are none
+    def _parse(self, parse, url, text, args):
+        if self._executor != None:
+            return self._executor.submit(parse, url, text, *args)
+        future = Future()
+        try:
+            future.set_result(parse(url, text, *args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    # Fetches a single url and returns the page text
+    def get(self, url):
+        meta = self.cache.lookup(url) if self.cache != None else None
+        text = self._page(url, meta, self._submit(url, meta).result())
+        if text == None:
+            text = self._page(url, None, self._submit(url, None).result())
+        return text
+
+    # Fetches urls concurrently and yields parse(url, text, *args) for each page, in completion order
+    # Failed urls are reported and skipped
+    # Results must be JSON serialisable to be kept in the cache
+    # Can be called from several threads at once, e.g. to crawl several websites together
+    def imap(self, urls, parse, *args):
+        for _, result in self._imap(urls, parse, args):
+            yield result
+
+    # Same as imap but yields (url, result) pairs, with a None result for the urls that failed
+    # so the caller knows when each url is done
+    def imap_urls(self, urls, parse, *args):
+        return self._imap(urls, parse, args, failures=True)
+
+    # Same as imap but returns the list of results, in the order of urls
+    def map(self, urls, parse, *args):
+        urls = list(urls)
+        results = dict(self._imap(urls, parse, args))
+        return [results[u] for u in urls if u in results]
+
+    # Yields (url, result) pairs for imap, imap_urls and map, (url, None) for failed urls if failures is set
+    def _imap(self, urls, parse, args, failures=False):
+        parse_name = parse.__name__+(repr(args) if len(args) > 0 else '') if self.cache != None else None
+        urls = iter(urls)
+        window = self.limit * 2 # bounds the number of pages held in memory
+        fetching = {}
+        parsing = {}
+        exhausted = False
+        while True:
+            while not exhausted and len(fetching) + len(parsing) < window:
+                url = next(urls, None)
+                if url == None:
+                    exhausted = True
+                else:
+                    meta = self.cache.lookup(url) if self.cache != None else None
+                    fetching[self._submit(url, meta)] = (url, meta)
+            if len(fetching) == 0 and len(parsing) == 0:
+                return
+            done, _ = wait(list(fetching) + list(parsing), return_when=FIRST_COMPLETED)
+            for f in done:
+                if f in fetching:
+                    url, meta = fetching.pop(f)
+                    try:
+                        response = f.result()
+                    except Exception as e:
+                        print('Failed fetching %s: %r'%(url, e))
+                        self._failed(url, parse, args, e, getattr(e, 'status', None))
+                        if failures:
+                            yield url, None
+                        continue
+                    if response[0] == 304 and parse_name != None and meta != None:
+                        result = self.cache.parsed(meta, parse_name)
+                        if result != None:
+                            self.cache.revalidated(meta)
+                            self._succeeded(url)
+                            yield url, result
+                            continue
+                    text = self._page(url, meta, response)
+                    if text == None:
+                        fetching[self._submit(url, None)] = (url, None)
+                    else:
+                        parsing[self._parse(parse, url, text, args)] = (url, response[0])
+                else:
+                    url, status = parsing.pop(f)
+                    try:
+                        result = f.result()
+                    except Exception as e:
+                        print('Failed parsing %s: %r'%(url, e))
+                        self._failed(url, parse, args, e, status)
+                        if failures:
+                            yield url, None
+                        continue
+                    if parse_name != None:
+                        self.cache.store_parsed(url, parse_name, result)
+                    self._succeeded(url)
+                    yield url, result
+
+    def _failed(self, url, parse, args, error, status):
+        if self.dead_letters != None:
+            self.dead_letters.record(url, parse.__name__, list(args), error, status)
+
+    def _succeeded(self, url):
+        if self.dead_letters != None:
+            self.dead_letters.resolved(url)
+
+    # Prints statistics on the run: requests, retries and latency per host, cache hits and failed urls
+    def report(self):
+        for host, throttle in sorted(self._throttles.items()):
+            throttle.report(host)
+        if self.cache != None:
+            self.cache.report()
+        if self.dead_letters != None:
+            self.dead_letters.report()
+
+    def close(self):
+        if self._loop.is_closed():
+            return
+        if self._loop.is_running():
+            self._run(self._session.close())
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+        self._loop.close()
+        if self._executor != None:
+            self._executor.shutdown()
+
+# Options given to the engines when created, see configure()
+fetcher_options = {}
+_fetchers = {}
+
+# Sets the Fetcher options (limit, limit_per_host, keepalive_timeout, parse_workers, timeout, cache,
+# rate_per_host, retries, backoff, max_backoff, dead_letters)
+# used by get_fetcher(), the engine of the current process is replaced if it already exists
+def configure(**options):
+    fetcher_options.update(options)
+    fetcher = _fetchers.pop(os.getpid(), None)
+    if fetcher != None:
+        fetcher.close()
+
+# Returns the engine owned by the current process, creating it on first use
+# Each process (e.g. the workers of a multiprocessing pool) gets its own session and connection pool
+def get_fetcher():
+    pid = os.getpid()
+    if pid not in _fetchers:
+        _fetchers[pid] = Fetcher(**fetcher_options)
+    return _fetchers[pid]
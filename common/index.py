@@ -0,0 +1,25 @@
+import os
+import sqlite3
+
+# Persistent index of the ids of the items already scraped, by group (e.g. the editions of a website), saved in an SQLite file.
+# Incremental crawls read it to stop once they reach items already known, and add the items they scrape.
+class KnownIndex:
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS known (grp TEXT, id TEXT, PRIMARY KEY (grp, id)) WITHOUT ROWID')
+
+    # Returns the set of ids known for group
+    def known(self, group):
+        return {r[0] for r in self.db.execute('SELECT id FROM known WHERE grp = ?', (group, ))}
+
+    # Adds ids to group, in a single transaction
+    def add(self, group, ids):
+        with self.db:
+            self.db.executemany('INSERT OR IGNORE INTO known VALUES (?, ?)', [(group, i) for i in ids])
+
+    def close(self):
+        self.db.close()
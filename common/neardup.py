@@ -0,0 +1,150 @@
+import multiprocessing as mp
+import zlib
+from array import array
+from collections import deque
+from common.text import normalise
+
+# Universal hash of the shingles, modulo a Mersenne prime (fixed coefficients: signatures are the same from run to run)
+_prime = (1 << 61) - 1
+_a = 0x5DEECE66D2B3F1
+_b = 0x2545F4914F6CDD1D % _prime
+# Offset of the values borrowed by empty bins, so they differ from the values of the bins they are borrowed from
+_offset = 0x9E3779B1
+
+# Returns the set of hashes of the shingles of text: its sequences of size consecutive words,
+# lower-cased with tags, quotes and whitespaces normalised (a text shorter than size words is a single shingle)
+def shingles(text, size=5):
+    words = normalise(text.lower(), strip=True).split(' ')
+    if words == ['']:
+        return set()
+    return {zlib.crc32(' '.join(words[i:i+size]).encode('utf-8')) for i in range(max(1, len(words)-size+1))}
+
+# Returns the MinHash signature of text (num_perm 32-bit values), None if it has no words.
+# One permutation hashing: each shingle is hashed once, and falls in one of num_perm bins keeping their minimum,
+# instead of hashing each shingle num_perm times; empty bins borrow the value of the next bin that is not (rotation)
+# Two texts have the same value in a bin with a probability of their Jaccard similarity
+def minhash(text, num_perm=128, shingle_size=5):
+    hashes = shingles(text, shingle_size)
+    if len(hashes) == 0:
+        return None
+    mins = [None] * num_perm
+    for x in hashes:
+        h = (_a * x + _b) % _prime
+        b = h % num_perm
+        v = h // num_perm
+        if mins[b] == None or v < mins[b]:
+            mins[b] = v
+    signature = array('I', bytes(4 * num_perm))
+    for i in range(num_perm):
+        t = 0
+        while mins[(i+t) % num_perm] == None:
+            t += 1
+        signature[i] = (mins[(i+t) % num_perm] + t * _offset) & 0xFFFFFFFF
+    return signature
+
+def _signatures(texts, num_perm, shingle_size):
+    return [minhash(t, num_perm, shingle_size) for t in texts]
+
+# Index of near-duplicate documents (MinHash + LSH), in time linear in the number of documents:
+# each signature is cut into bands of num_perm/bands values, and a document is only compared to the documents
+# with the same values in one of its bands. Pairs whose estimated Jaccard similarity (on their shingles) is at least threshold
+# are merged in the same cluster, so a cluster holds documents linked by near-duplicate pairs.
+# With the defaults, pairs with a similarity of 0.8 share a band with a probability of 0.95, pairs of 0.5 of 0.06.
+# Memory: num_perm*4 bytes and one entry per band per document
+class NearDuplicateIndex:
+    def __init__(self, threshold=0.8, num_perm=128, bands=16, shingle_size=5):
+        if num_perm % bands != 0:
+            raise ValueError('num_perm (%i) must be a multiple of bands (%i)'%(num_perm, bands))
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self.keys = []
+        self.signatures = []
+        self.parents = []
+        self.buckets = [{} for _ in range(bands)]
+        self.stats = {'documents':0, 'empty':0, 'compared':0, 'pairs':0}
+
+    def _find(self, i):
+        root = i
+        while self.parents[root] != root:
+            root = self.parents[root]
+        while self.parents[i] != root:
+            self.parents[i], i = root, self.parents[i]
+        return root
+
+    def _similarity(self, s1, s2):
+        return sum(1 for x, y in zip(s1, s2) if x == y) / self.num_perm
+
+    # Adds a document given its key (e.g. its id) and its signature (see minhash()), ignored if None (no words)
+    def add(self, key, signature):
+        if signature == None:
+            self.stats['empty'] += 1
+            return
+        i = len(self.keys)
+        self.keys.append(key)
+        self.signatures.append(signature)
+        self.parents.append(i)
+        self.stats['documents'] += 1
+        for band, buckets in enumerate(self.buckets):
+            h = hash(tuple(signature[band*self.rows:(band+1)*self.rows]))
+            bucket = buckets.get(h)
+            if bucket == None:
+                buckets[h] = i # most buckets hold one document
+                continue
+            if isinstance(bucket, int):
+                buckets[h] = bucket = [bucket]
+            for j in bucket:
+                if self._find(j) != self._find(i):
+                    self.stats['compared'] += 1
+                    if self._similarity(signature, self.signatures[j]) >= self.threshold:
+                        self.parents[self._find(j)] = self._find(i)
+                        self.stats['pairs'] += 1
+            bucket.append(i)
+
+    # Adds documents given as (key, text), returns their number
+    # The signatures are computed by chunks of documents in a pool of workers processes (in this process if workers is 1),
+    # at most two chunks waiting per worker, so documents can be read from a file
+    def add_texts(self, documents, workers=None, chunk_size=1000):
+        if workers == 1:
+            n = 0
+            for key, text in documents:
+                self.add(key, minhash(text, self.num_perm, self.shingle_size))
+                n += 1
+            return n
+        workers = workers or max(1, mp.cpu_count()-1)
+        pending = deque()
+        n = 0
+        def collect():
+            keys, result = pending.popleft()
+            for key, signature in zip(keys, result.get()):
+                self.add(key, signature)
+            return len(keys)
+        with mp.Pool(workers) as pool:
+            def submit(chunk):
+                pending.append(([k for k, _ in chunk], pool.apply_async(_signatures, ([t for _, t in chunk], self.num_perm, self.shingle_size))))
+            chunk = []
+            for d in documents:
+                chunk.append(d)
+                if len(chunk) == chunk_size:
+                    submit(chunk)
+                    chunk = []
+                    while len(pending) >= 2*workers:
+                        n += collect()
+            if len(chunk) > 0:
+                submit(chunk)
+            while len(pending) > 0:
+                n += collect()
+        return n
+
+    # Returns the clusters of near-duplicates (lists of keys, in the order the documents were added), largest first
+    def clusters(self):
+        groups = {}
+        for i in range(len(self.keys)):
+            groups.setdefault(self._find(i), []).append(self.keys[i])
+        return sorted((g for g in groups.values() if len(g) > 1), key=len, reverse=True)
+
+    def report(self):
+        clusters = self.clusters()
+        print('Near-duplicates: %i documents (%i without text), %i pairs compared, %i near-duplicate pairs, %i clusters of %i documents'%(
+            self.stats['documents'], self.stats['empty'], self.stats['compared'], self.stats['pairs'], len(clusters), sum(map(len, clusters))))
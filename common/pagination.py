@@ -0,0 +1,54 @@
+import re
+import aiohttp
+from common.fetcher import get_fetcher
+
+page_pattern = re.compile(r'[?&;]page=(\d+)')
+
+# Returns the highest page number linked from a listing page (i.e. in its pagination links), None if there is none
+def last_linked_page(text):
+    pages = [int(p) for p in page_pattern.findall(text)]
+    return max(pages) if len(pages) > 0 else None
+
+# Finds the number of the last page of a listing holding items, has_items(page) telling if a page holds any
+# Pagination links may only show the pages around the current one, so hint (e.g. from last_linked_page()) is checked:
+# from the last page known to hold items, the step doubles until an empty page is found (galloping),
+# then a binary search between the two finds the last page, i.e. O(log n) pages fetched instead of n
+# Returns first-1 if the listing is empty
+def find_last_page(has_items, first=0, hint=None):
+    if not has_items(first):
+        return first - 1
+    last = first
+    empty = None
+    if hint != None and hint > first:
+        if has_items(hint):
+            last = hint
+        else:
+            empty = hint
+    if empty == None:
+        step = 1
+        while has_items(last + step):
+            last += step
+            step *= 2
+        empty = last + step
+    while empty - last > 1:
+        middle = (last + empty) // 2
+        if has_items(middle):
+            last = middle
+        else:
+            empty = middle
+    return last
+
+# Returns the has_items(page) function of find_last_page() for the listing at url_base+page,
+# parse(url, text) returning the items of a page
+# A missing page (HTTP 404 or 410) is past the end of the listing, so holds no items
+def listing_probe(url_base, parse):
+    def has_items(page):
+        url = url_base+str(page)
+        try:
+            text = get_fetcher().get(url)
+        except aiohttp.ClientResponseError as e:
+            if e.status in (404, 410):
+                return False
+            raise
+        return len(parse(url, text)) > 0
+    return has_items
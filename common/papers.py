@@ -0,0 +1,215 @@
+import csv
+import os
+import queue
+import threading
+from common.fetcher import get_fetcher
+from common.dates import parse_year
+from common.progress import ProgressStore
+from common.dedup import merge_duplicates, merge_into_csv
+from common.sinks import write_csv
+from common.columnar import write_parquet
+from common.corpus import CorpusStore
+
+# Number of authors whose research outputs are listed at once,
+# and maximum number of paper urls listed but not yet fetched (listing pauses when reached)
+listing_workers = 4
+queue_size = 1000
+
+# Producer: lists the research outputs of the authors taken from the authors queue and puts (author id, paper url) in the urls queue,
+# then (author id, True) once the author's listing is complete, or (author id, False) if it failed
+# Puts None when there are no authors left
+# Authors in known (author id -> urls listed in a previous run) are only listed up to the papers known if list_new_outputs is given
+def _list_outputs_worker(authors, urls, list_outputs, list_new_outputs, args, known):
+    while True:
+        try:
+            auth_url, auth_id = authors.get_nowait()
+        except queue.Empty:
+            break
+        print('Starting author %s'%auth_id)
+        try:
+            if list_new_outputs != None and auth_id in known:
+                listing = list_new_outputs(auth_url, known[auth_id], *args)
+            else:
+                listing = list_outputs(auth_url, *args)
+            for page in listing:
+                for u in page:
+                    urls.put((auth_id, u))
+            urls.put((auth_id, True))
+        except Exception as e:
+            print('Failed listing author %s: %r'%(auth_id, e))
+            urls.put((auth_id, False))
+    urls.put(None)
+
+# Fetches the papers of the authors in author_urls ((profile url, author id) pairs) in a single pipeline:
+# listing_workers threads list the authors' research outputs into a bounded queue of paper urls,
+# drained by the fetcher, so requests stay in flight across author boundaries
+# - list_outputs(auth_url, *args) yields the paper urls listed on each page of an author's research outputs,
+#   and raises an exception if a page fails, so the author is not recorded with an incomplete listing;
+# - get_paper(url, text, *args) parses a paper page, its date is converted by parse_year();
+# - list_new_outputs(auth_url, known_urls, *args), if given, lists the authors in known only up to the papers known
+#   (for listings sorted newest first, see list_new_outputs() in pure.py).
+# A paper listed by several authors is fetched once, papers already in the journal (store, a ProgressStore) are not fetched again
+# An author is recorded in the journal once its listing is complete and all its papers are done
+def fetch_authors_papers(author_urls, store, list_outputs, get_paper, args=(), known={}, list_new_outputs=None):
+    authors = queue.Queue()
+    for a_u in author_urls:
+        authors.put(a_u)
+    urls = queue.Queue(queue_size)
+    listed = {} # author id -> urls listed
+    pending = {} # author id -> urls listed and still being fetched
+    complete = {} # author id -> True if the listing is complete, False if it failed
+    waiting = {} # url being fetched -> ids of the authors listing it
+    fetched = {} # url -> paper fetched but not recorded yet
+
+    def record(auth_id):
+        if auth_id not in complete or len(pending[auth_id]) > 0:
+            return
+        paper_urls = list(listed.pop(auth_id))
+        del pending[auth_id]
+        if complete.pop(auth_id):
+            papers = [fetched.pop(u) for u in paper_urls if u in fetched]
+            store.record_author(auth_id, paper_urls, papers)
+            print('Author %s: %i papers, %i fetched'%(auth_id, len(paper_urls), len(papers)))
+
+    # yields the urls to fetch, runs in this thread so the journal is only used here
+    def new_urls():
+        n_running = listing_workers
+        while n_running > 0:
+            item = urls.get()
+            if item == None:
+                n_running -= 1
+                continue
+            auth_id, url = item
+            listed.setdefault(auth_id, {})
+            pending.setdefault(auth_id, set())
+            if isinstance(url, bool):
+                complete[auth_id] = url
+                record(auth_id)
+            elif url not in listed[auth_id]:
+                listed[auth_id][url] = None
+                if url in waiting:
+                    waiting[url].add(auth_id)
+                    pending[auth_id].add(url)
+                elif url not in fetched and len(store.new_urls([url])) > 0:
+                    waiting[url] = {auth_id}
+                    pending[auth_id].add(url)
+                    yield url
+
+    workers = [threading.Thread(target=_list_outputs_worker, args=(authors, urls, list_outputs, list_new_outputs, args, known), daemon=True)
+        for _ in range(listing_workers)]
+    for w in workers:
+        w.start()
+    for url, paper in get_fetcher().imap_urls(new_urls(), get_paper, *args):
+        if paper != None:
+            paper['date'] = parse_year(paper['date'])
+            fetched[url] = paper
+        for auth_id in waiting.pop(url):
+            pending[auth_id].discard(url)
+            record(auth_id)
+
+# Crawl of the papers of a university's authors, the steps shared by the university scrapers, given their files and parsers:
+# - auth_path: authors file (id, name, url and organisation of each author), fetched by the scraper;
+# - progress_path: journal of the crawl (see ProgressStore), so it can be interrupted and resumed;
+# - raw_papers_path: papers found, one row per paper and author; papers_path: unique papers, with the ids of all their authors;
+# - corpus_path: corpus store shared by the scrapers (see CorpusStore);
+# - list_outputs, get_paper, args and list_new_outputs: see fetch_authors_papers(),
+#   args also select the failed papers to replay (e.g. the code of a Pure institution).
+class PaperCrawl:
+    def __init__(self, auth_path, progress_path, raw_papers_path, papers_path, list_outputs, get_paper, args=(),
+            list_new_outputs=None, corpus_path='data/corpus.db'):
+        self.auth_path = auth_path
+        self.progress_path = progress_path
+        self.raw_papers_path = raw_papers_path
+        self.papers_path = papers_path
+        self.corpus_path = corpus_path
+        self.list_outputs = list_outputs
+        self.get_paper = get_paper
+        self.args = tuple(args)
+        self.list_new_outputs = list_new_outputs
+
+    # Returns the (profile url, id) of the authors
+    def author_urls(self):
+        with open(self.auth_path, 'r', encoding='utf-8') as inFile:
+            return [(row['url'],row['id']) for row in csv.DictReader(inFile)]
+
+    def _fetch(self, author_urls, store, known={}):
+        fetch_authors_papers(author_urls, store, self.list_outputs, self.get_paper, self.args, known, self.list_new_outputs)
+
+    # Exports the papers recorded in the journal to the raw papers file
+    def _write_raw_papers(self, store):
+        with open(self.raw_papers_path, 'w', encoding='utf-8', newline='') as outFile:
+            print('%i papers found in total'%store.write_raw_papers(outFile))
+
+    # Fetches the papers of the authors not done yet (resuming an interrupted run), and writes the raw papers file
+    def fetch_papers(self):
+        author_urls = self.author_urls()
+        store = ProgressStore(self.progress_path)
+        done = store.done_authors()
+        print('%i of %i authors already done'%(len(done), len(author_urls)))
+        self._fetch([a_u for a_u in author_urls if a_u[1] not in done], store)
+        self._write_raw_papers(store)
+        store.close()
+
+    # Fetches again the papers that failed in previous runs and adds them to the journal
+    # (their authors are already recorded, with the urls of all their papers), without crawling again
+    # Returns the urls of the papers recovered, for refresh_papers() (they were listed before the last crawl)
+    def replay_papers(self):
+        urls = get_fetcher().dead_letters.urls(self.get_paper.__name__, list(self.args))
+        print('Replaying %i failed papers'%len(urls))
+        store = ProgressStore(self.progress_path)
+        recovered = set()
+        def papers():
+            for p in get_fetcher().imap(urls, self.get_paper, *self.args):
+                recovered.add(p['url'])
+                yield dict(p, date=parse_year(p['date']))
+        print('Recovered %i papers'%store.record_papers(papers()))
+        store.close()
+        return recovered
+
+    # Incremental refresh: lists the research outputs of all authors again (only up to the papers found in previous runs
+    # with list_new_outputs), fetches only the new papers, and merges them into the papers file and the corpus store
+    # without merging all papers again (the papers file is made by clean_duplicates() if missing)
+    # The papers recovered by replay_papers() (urls in recovered) are merged too
+    def refresh_papers(self, recovered=()):
+        author_urls = self.author_urls()
+        store = ProgressStore(self.progress_path)
+        since = store.last_link()
+        print('Refreshing %i authors'%len(author_urls))
+        self._fetch(author_urls, store, store.author_urls())
+        self._write_raw_papers(store)
+        if os.path.exists(self.papers_path):
+            n_updated, n_added = merge_into_csv(self.papers_path, store.raw_papers(since, recovered), 'url', 'author_id', 'author_ids')
+            print('%i new papers, %i papers with new authors'%(n_added, n_updated))
+        else:
+            self.clean_duplicates()
+        store.close()
+        self.load_corpus(since, recovered)
+
+    # Merges the papers of the raw papers file listed by several authors into the papers file,
+    # and writes them to the Parquet dataset parquet_path too if given (see write_papers_parquet())
+    def clean_duplicates(self, parquet_path=None):
+        with open(self.raw_papers_path, 'r', encoding='utf-8') as inFile:
+            n_papers, uniq_papers = merge_duplicates(csv.DictReader(inFile), 'url', 'author_id', 'author_ids')
+            print('%i papers originally'%n_papers)
+            with open(self.papers_path, 'w', encoding='utf-8', newline='') as outFile:
+                print('Found %i unique papers'%write_csv(outFile, uniq_papers))
+        if parquet_path != None:
+            self.write_papers_parquet(parquet_path)
+
+    # Writes the unique papers to a Parquet dataset (requires pyarrow), partitioned by organisation and year
+    # (papers whose date is not recognised have an empty year), so downstream jobs read only the columns and years they need
+    def write_papers_parquet(self, path):
+        with open(self.papers_path, 'r', encoding='utf-8') as inFile:
+            rows = (dict(r, year=r['date'] if r['date'].isdigit() else '') for r in csv.DictReader(inFile))
+            print('%i papers written to %s'%(write_parquet(path, rows, ('organisation', 'year')), path))
+
+    # Saves the authors and the papers in the corpus store, in large transactions
+    # Only the papers listed after since (see ProgressStore.last_link()) and those in urls if given: the others are already stored
+    def load_corpus(self, since=0, urls=()):
+        corpus = CorpusStore(self.corpus_path)
+        with open(self.auth_path, 'r', encoding='utf-8') as inFile:
+            corpus.upsert_authors(csv.DictReader(inFile))
+        store = ProgressStore(self.progress_path)
+        print('%i papers (one row per author) saved in %s'%(corpus.upsert_papers(store.raw_papers(since, urls)), self.corpus_path))
+        store.close()
+        corpus.close()
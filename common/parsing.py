@@ -0,0 +1,44 @@
+from bs4 import BeautifulSoup, SoupStrainer
+
+# Parser used to build the soups: lxml (C-backed) if installed, otherwise Python's html.parser
+try:
+    import lxml
+    parser = 'lxml'
+except ImportError:
+    parser = 'html.parser'
+
+# Builds the soup of a page with the fastest parser available
+# Given a strainer (see make_strainer()), only the elements it matches (and their content) are built
+def make_soup(text, strainer=None):
+    return BeautifulSoup(text, parser, parse_only=strainer)
+
+# Strainer keeping only the elements the extractors need, so the rest of the page is never built:
+# elements named in names, or whose attribute (given as keyword, class_ for class) holds one of the values
+# e.g. make_strainer(['h1'], class_=['persons', 'status']) keeps <h1>, <p class="persons"> and <div class="status">
+def make_strainer(names=(), **attrs):
+    return _Strainer(names, {k.rstrip('_'):set(v) for k,v in attrs.items()})
+
+class _Strainer(SoupStrainer):
+    def __init__(self, names, attrs):
+        SoupStrainer.__init__(self)
+        self.names = set(names)
+        self.attrs = attrs
+
+    def _matches(self, name, attrs):
+        if name in self.names:
+            return True
+        for k, values in self.attrs.items():
+            v = attrs.get(k)
+            if v:
+                tokens = v if isinstance(v, list) else v.split()
+                if any(t in values for t in tokens):
+                    return True
+        return False
+
+    # bs4 4.13 and later
+    def allow_tag_creation(self, nsprefix, name, attrs):
+        return self._matches(name, attrs or {})
+
+    # bs4 4.12 and earlier
+    def search_tag(self, markup_name=None, markup_attrs={}):
+        return self._matches(markup_name, markup_attrs)
@@ -0,0 +1,91 @@
+import json
+import os
+import sqlite3
+from common.sinks import write_csv
+
+# Journal of a paper crawl, saved in an SQLite file so a run can be interrupted at any time and resumed.
+# Tables:
+# - authors: authors whose papers have all been fetched;
+# - papers: record fetched for each paper url;
+# - author_papers: urls of the papers listed on each author's profile.
+# An author and its papers are recorded in a single transaction,
+# so after a crash the journal holds either all or none of them.
+# The papers table is also the index of the urls already fetched during the crawl:
+# a paper co-authored by several authors is fetched once and linked to each of them.
+class ProgressStore:
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS authors (id TEXT PRIMARY KEY, n_papers INTEGER);
+            CREATE TABLE IF NOT EXISTS papers (url TEXT PRIMARY KEY, record TEXT);
+            CREATE TABLE IF NOT EXISTS author_papers (author_id TEXT, url TEXT, PRIMARY KEY (author_id, url));
+        ''')
+
+    # Returns the set of ids of the authors already recorded
+    def done_authors(self):
+        return {r[0] for r in self.db.execute('SELECT id FROM authors')}
+
+    # Returns the urls (without duplicates) of the papers not fetched yet
+    def new_urls(self, urls):
+        new = []
+        for u in dict.fromkeys(urls):
+            if self.db.execute('SELECT 1 FROM papers WHERE url = ?', (u, )).fetchone() == None:
+                new.append(u)
+        return new
+
+    # Returns the urls of the papers already listed for each author, by author id
+    def author_urls(self):
+        urls = {}
+        for author_id, url in self.db.execute('SELECT author_id, url FROM author_papers'):
+            urls.setdefault(author_id, set()).add(url)
+        return urls
+
+    # Records the urls of the papers listed for an author, the papers newly fetched, and the author as done
+    # The urls are added to those already recorded for the author (e.g. by a previous run, see refresh_papers() in pure.py)
+    def record_author(self, author_id, paper_urls, papers):
+        with self.db:
+            for p in papers:
+                record = {k:v for k,v in p.items() if k != 'author_id'}
+                self.db.execute('INSERT OR REPLACE INTO papers VALUES (?, ?)', (record['url'], json.dumps(record)))
+            self.db.executemany('INSERT OR IGNORE INTO author_papers VALUES (?, ?)', [(author_id, u) for u in paper_urls])
+            n_papers = self.db.execute('SELECT COUNT(*) FROM author_papers WHERE author_id = ?', (author_id, )).fetchone()[0]
+            self.db.execute('INSERT INTO authors VALUES (?, ?) ON CONFLICT (id) DO UPDATE SET n_papers = excluded.n_papers',
+                (author_id, n_papers)) # keeps the author's rank in raw_papers()
+
+    # Records papers fetched again after failing (see DeadLetterStore), returns their number
+    def record_papers(self, papers):
+        n = 0
+        with self.db:
+            for p in papers:
+                self.db.execute('INSERT OR REPLACE INTO papers VALUES (?, ?)', (p['url'], json.dumps(p)))
+                n += 1
+        return n
+
+    # Returns a mark of the papers listed so far, for raw_papers()
+    def last_link(self):
+        return self.db.execute('SELECT COALESCE(MAX(rowid), 0) FROM author_papers').fetchone()[0]
+
+    # Yields one row per paper and author, with the author's id in 'author_id'
+    # (i.e. the rows of the raw papers files)
+    # Only the papers listed after since (a mark returned by last_link()) if given,
+    # and the papers whose url is in urls, whenever they were listed (e.g. papers fetched again after failing)
+    def raw_papers(self, since=0, urls=()):
+        query = '''SELECT p.record, ap.author_id, ap.url, ap.rowid FROM author_papers ap JOIN papers p ON p.url = ap.url
+            JOIN authors a ON a.id = ap.author_id WHERE ap.rowid > ? ORDER BY a.rowid'''
+        for record, author_id, url, link in self.db.execute(query, (since if len(urls) == 0 else 0, )):
+            if link <= since and url not in urls:
+                continue
+            paper = json.loads(record)
+            paper['author_id'] = author_id
+            yield paper
+
+    # Writes the raw papers in CSV to outFile, returns the number of rows
+    def write_raw_papers(self, outFile):
+        return write_csv(outFile, self.raw_papers())
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,120 @@
+import csv
+import gzip
+import json
+import os
+
+# Opens a text file (mode 'r', 'w' or 'a') for the csv module, compressed with gzip if path ends with .gz
+def open_text(path, mode='r'):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode+'t', encoding='utf-8', newline='')
+    return open(path, mode, encoding='utf-8', newline='')
+
+# Concatenates CSV files in outFile, streaming their rows one at a time, so memory does not grow with the files
+# The header is the union of the files' columns (in order of first appearance), values missing from a file are left empty
+# Returns the number of rows written
+def concat_csv(paths, outFile):
+    fields = {}
+    for p in paths:
+        with open_text(p) as inFile:
+            fields.update(dict.fromkeys(next(csv.reader(inFile), [])))
+    w = csv.DictWriter(outFile, list(fields), quoting=csv.QUOTE_ALL, restval='')
+    w.writeheader()
+    n_rows = 0
+    for p in paths:
+        with open_text(p) as inFile:
+            for r in csv.DictReader(inFile):
+                w.writerow(r)
+                n_rows += 1
+    return n_rows
+
+# Writes rows (dictionaries) in CSV to outFile, with the keys of the first row as header
+# Returns the number of rows written
+def write_csv(outFile, rows):
+    w = None
+    n_rows = 0
+    for r in rows:
+        if w == None:
+            w = csv.DictWriter(outFile, r.keys(), quoting=csv.QUOTE_ALL)
+            w.writeheader()
+        w.writerow(r)
+        n_rows += 1
+    return n_rows
+
+# Appends records to a JSON Lines file (one JSON object per line) as they arrive,
+# so records are never held in memory and those written survive a crash.
+# A line left incomplete by a crash is removed when the file is opened again,
+# unless append is False, in which case the file is overwritten.
+class JSONLinesSink:
+    def __init__(self, path, append=True):
+        self.path = path
+        self.count = 0
+        if append and os.path.exists(path):
+            _truncate_partial_line(path)
+        self.file = open(path, 'a' if append else 'w', encoding='utf-8')
+
+    def write(self, record):
+        self.file.write(json.dumps(record)+'\n')
+        self.file.flush()
+        self.count += 1
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# Writes rows (dictionaries) to a new CSV file as they arrive, like write_csv(),
+# with fields as header or, if not given, the keys of the first row
+class CSVSink:
+    def __init__(self, path, fields=None):
+        self.path = path
+        self.count = 0
+        self.file = open_text(path, 'w')
+        self.writer = None
+        if fields != None:
+            self._open_writer(fields)
+
+    def _open_writer(self, fields):
+        self.writer = csv.DictWriter(self.file, fields, quoting=csv.QUOTE_ALL)
+        self.writer.writeheader()
+
+    def write(self, row):
+        if self.writer == None:
+            self._open_writer(row.keys())
+        self.writer.writerow(row)
+        self.count += 1
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def _truncate_partial_line(path):
+    with open(path, 'rb+') as f:
+        end = f.seek(0, os.SEEK_END)
+        pos = end
+        while pos > 0:
+            step = min(4096, pos)
+            f.seek(pos - step)
+            chunk = f.read(step)
+            i = chunk.rfind(b'\n')
+            if i >= 0:
+                pos = pos - step + i + 1
+                break
+            pos -= step
+        if pos < end:
+            f.truncate(pos)
+
+# Reads the records of a JSON Lines file one at a time
+def read_jsonl(path):
+    with open(path, 'r', encoding='utf-8') as inFile:
+        for line in inFile:
+            if line.strip() != '':
+                yield json.loads(line)
@@ -0,0 +1,98 @@
+import asyncio
+import random
+import time
+from email.utils import parsedate_to_datetime
+
+# Statuses retried by the fetcher, and those meaning the host asks us to slow down
+retry_statuses = {429, 500, 502, 503, 504}
+throttle_statuses = {429, 503}
+
+# Returns the number of seconds to wait given a Retry-After header (seconds or HTTP date), None if missing or invalid
+def parse_retry_after(value):
+    if value == None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+# Returns the delay before retry number attempt (from 0): exponential backoff with jitter, capped to max_backoff
+def backoff_delay(attempt, backoff, max_backoff):
+    delay = min(max_backoff, backoff * 2**attempt)
+    return delay * random.uniform(0.5, 1)
+
+# Limits the requests sent to a single host, used on the fetcher's event loop:
+# - a token bucket lets at most rate requests start per second (bursts of up to rate requests), None for no limit;
+# - the number of requests in flight adapts to the host (AIMD): it grows by one after a window of successful requests,
+#   up to max_concurrency, and is halved when the host answers 429 or 503;
+# - a Retry-After header pauses all requests to the host until the time given.
+class HostThrottle:
+    def __init__(self, rate, max_concurrency):
+        self.rate = rate
+        self.tokens = rate if rate != None else 0
+        self.updated = time.monotonic()
+        self.not_before = 0
+        self.max_concurrency = max_concurrency
+        self.concurrency = max_concurrency
+        self.active = 0
+        self.successes = 0
+        self._condition = asyncio.Condition()
+        self.stats = {'requests':0, 'retries':0, 'throttled':0, 'failed':0, 'latency':0.0, 'max_latency':0.0}
+
+    # Waits for a free slot and a token before sending a request
+    async def acquire(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.active < self.concurrency)
+            self.active += 1
+        await self._take_token()
+
+    async def release(self):
+        async with self._condition:
+            self.active -= 1
+            self._condition.notify_all()
+
+    async def _take_token(self):
+        while True:
+            now = time.monotonic()
+            if now < self.not_before:
+                await asyncio.sleep(self.not_before - now)
+                continue
+            if self.rate == None:
+                return
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    # Records a successful request, given its latency in seconds
+    def success(self, latency):
+        self.stats['requests'] += 1
+        self.stats['latency'] += latency
+        self.stats['max_latency'] = max(self.stats['max_latency'], latency)
+        self.successes += 1
+        if self.successes >= self.concurrency and self.concurrency < self.max_concurrency:
+            self.concurrency += 1
+            self.successes = 0
+
+    # Records a failed attempt, status None for network errors, retry_after in seconds if given by the host
+    def failure(self, status, retry_after, retried):
+        self.stats['requests'] += 1
+        self.stats['retries' if retried else 'failed'] += 1
+        if status in throttle_statuses:
+            self.stats['throttled'] += 1
+            self.concurrency = max(1, self.concurrency // 2)
+            self.successes = 0
+        if retry_after != None:
+            self.not_before = max(self.not_before, time.monotonic() + retry_after)
+
+    def report(self, host):
+        succeeded = self.stats['requests'] - self.stats['retries'] - self.stats['failed']
+        print('%s: %i requests, %i retries (%i throttled), %i failed, latency %.0f ms mean, %.0f ms max, concurrency %i/%i'%(
+            host, self.stats['requests'], self.stats['retries'], self.stats['throttled'], self.stats['failed'],
+            1000 * self.stats['latency'] / max(1, succeeded), 1000 * self.stats['max_latency'], self.concurrency, self.max_concurrency))
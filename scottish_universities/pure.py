@@ -0,0 +1,273 @@
+import time
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common.fetcher import configure, get_fetcher
+from common.cache import ResponseCache
+from common.deadletters import DeadLetterStore
+from common.parsing import make_soup, make_strainer
+from common.text import normalise
+from common.dates import paper_dates
+from common.papers import PaperCrawl
+from common.pagination import find_last_page, last_linked_page, listing_probe
+from common.sinks import write_csv
+from common.corpus import CorpusStore
+from common.neardup import NearDuplicateIndex
+
+# revalidates pages fetched in previous runs instead of downloading them again,
+# and records the pages that failed so they can be replayed (see replay_papers())
+configure(cache=ResponseCache('data/cache'), dead_letters=DeadLetterStore('data/failed.db'))
+
+##################################################
+# Institutions
+##################################################
+
+# Universities publishing their research on an Elsevier Pure portal, by code
+# Adding a university only requires adding its configuration:
+# - orga: name of the organisation, saved with authors and papers;
+# - id_prefix: prefix of the authors' unique ids;
+# - base_url_auth: url of the pages listing the authors' profiles, followed by the page number (the number of pages is found when crawling);
+# - research_output_page: path of the pages listing the research outputs of a profile, followed by the page number;
+# - profile_suffix: suffix removed from the profiles' url before adding research_output_page;
+# - output_selector: CSS selector of the research outputs' titles listed on a profile page;
+# - title_selector: CSS selector of the title of a research output page.
+# Files are saved in data/, named after the code.
+institutions = {
+    'hwu': {
+        'orga':'Heriot-Watt University', 'id_prefix':'HWU',
+        'base_url_auth':'https://researchportal.hw.ac.uk/en/persons/?format=&page=',
+        'research_output_page':'/publications/?page=', 'profile_suffix':'',
+        'output_selector':'h3.title', 'title_selector':'h1'},
+    'edi': {
+        'orga':'University of Edinburgh', 'id_prefix':'EDI',
+        'base_url_auth':'https://www.research.ed.ac.uk/en/persons/?format=&page=',
+        'research_output_page':'/publications/?page=', 'profile_suffix':'',
+        'output_selector':'h3.title', 'title_selector':'h1'},
+    'strath': {
+        'orga':'University of Strathclyde', 'id_prefix':'STRATH',
+        'base_url_auth':'https://pureportal.strath.ac.uk/en/persons/?format=&page=',
+        'research_output_page':'/publications/?page=', 'profile_suffix':'',
+        'output_selector':'h3.title', 'title_selector':'h1'},
+    'st_andrews': {
+        'orga':'University of St Andrews', 'id_prefix':'St_Andrews',
+        'base_url_auth':'https://risweb.st-andrews.ac.uk/portal/en/persons/search.html?page=',
+        'research_output_page':'/researchoutput.html/?page=', 'profile_suffix':'.html',
+        'output_selector':'h2.title', 'title_selector':'h1.title'},
+}
+
+def auth_out(code):
+    return 'data/%s_authors.csv'%code
+
+def progress_out(code):
+    return 'data/%s_progress.db'%code
+
+def raw_papers_out(code):
+    return 'data/%s_papers_raw.csv'%code
+
+def papers_out(code):
+    return 'data/%s_papers.csv'%code
+
+def papers_parquet_out(code):
+    return 'data/%s_papers.parquet'%code
+
+# shared by all the institutions (and the other scrapers)
+def corpus_out():
+    return 'data/corpus.db'
+
+##################################################
+# Scraping Authors
+##################################################
+
+def distributed_fetch(urls, fetch_callback, *args):
+    results = get_fetcher().map(urls, fetch_callback, *args)
+    print('Found %i results'%len(results))
+    return results
+
+def fetch_authors_page(url, text):
+    soup = make_soup(text, make_strainer(rel=['Person']))
+    authors = soup.find_all(rel="Person")
+    return [{'name':a.find('span').text, 'url':a['href']} for a in authors]
+
+# Finds the number of pages listing authors, from the pagination links of the first page
+def count_authors_pages(code):
+    base_url_auth = institutions[code]['base_url_auth']
+    return find_last_page(listing_probe(base_url_auth, fetch_authors_page), 0, last_linked_page(get_fetcher().get(base_url_auth+'0'))) + 1
+
+def fetch_authors(code):
+    inst = institutions[code]
+    n_pages_auth = count_authors_pages(code)
+    print('Fetching authors from %i pages'%n_pages_auth)
+    pages = distributed_fetch([inst['base_url_auth']+str(i) for i in range(n_pages_auth)], fetch_authors_page)
+    if len(pages) < n_pages_auth: # the authors' ids must not change once saved
+        raise RuntimeError('%i of %i pages of authors failed, run again to fetch all authors'%(n_pages_auth-len(pages), n_pages_auth))
+    authors = [a for p in pages for a in p]
+    authors = [{'id':'%s%i'%(inst['id_prefix'],i), 'name':a['name'], 'url':a['url'], 'organisation':inst['orga']} for i,a in enumerate(authors)]
+    print('Found %i profiles'%len(authors))
+    with open(auth_out(code), 'w', encoding='utf-8', newline='') as outFile:
+        write_csv(outFile, authors)
+
+##################################################
+# Scraping Papers
+##################################################
+
+def get_text(dom_elt):
+    if dom_elt != None:
+        return normalise(str(dom_elt), strip=True)
+    else:
+        return ''
+
+# only the elements get_paper() reads are parsed
+paper_strainer = make_strainer(['h1'], class_=['persons', 'rendering_abstractportal', 'status'])
+
+def get_paper(url, text, code):
+    inst = institutions[code]
+    soup = make_soup(text, paper_strainer)
+    title = get_text(soup.select_one(inst['title_selector']))
+    authors = get_text(soup.find(class_='persons'))
+    abstract = get_text(soup.find(class_='rendering_abstractportal'))
+    status = soup.find(class_='status')
+    date = get_text(status.find(class_='date')) # converted by parse_year()
+    return {'title':title,'authors':authors,'date':date,'abstract':abstract,'url':url,'organisation':inst['orga']}
+
+def remove_suffix(input_string, suffix):
+    if suffix and input_string.endswith(suffix):
+        return input_string[:-len(suffix)]
+    return input_string
+
+def get_output_urls(url, text, code):
+    soup = make_soup(text, make_strainer(class_=['title']))
+    papers = soup.select(institutions[code]['output_selector'])
+    return [p.find('a')['href'] for p in papers], last_linked_page(text)
+
+# Yields the paper urls listed on each page of an author's research outputs, as soon as each page arrives
+# The number of pages is read from the pagination links of the first page, and the other pages are fetched concurrently
+# (the links of the pages fetched extend the listing when it shows only the pages around the current one)
+# Raises an exception if a page fails, so the author is not recorded with an incomplete listing
+def list_author_outputs(auth_url, code):
+    inst = institutions[code]
+    url_base = remove_suffix(auth_url, inst['profile_suffix'])+inst['research_output_page']
+    urls, last = get_output_urls(url_base+'0', get_fetcher().get(url_base+'0'), code)
+    yield urls
+    if len(urls) == 0:
+        return
+    requested = 0
+    last = last or 0
+    while last > requested:
+        pages = [url_base+str(i) for i in range(requested+1, last+1)]
+        requested = last
+        for url, result in get_fetcher().imap_urls(pages, get_output_urls, code):
+            if result == None:
+                raise RuntimeError('Failed listing %s'%url)
+            urls, linked = result
+            yield urls
+            last = max(last, linked or 0)
+
+# Yields the paper urls not in known listed on each page of an author's research outputs, newest first,
+# up to the first page holding a known url: the papers after it were listed in a previous run
+def list_new_outputs(auth_url, known, code):
+    inst = institutions[code]
+    url_base = remove_suffix(auth_url, inst['profile_suffix'])+inst['research_output_page']
+    page = 0
+    while True:
+        urls, _ = get_output_urls(url_base+str(page), get_fetcher().get(url_base+str(page)), code)
+        new = [u for u in urls if u not in known]
+        yield new
+        if len(urls) == 0 or len(new) < len(urls):
+            return
+        page += 1
+
+# Crawl of the papers of an institution (journal, replay, refresh, duplicates and corpus store), see common/papers.py
+def paper_crawl(code):
+    return PaperCrawl(auth_out(code), progress_out(code), raw_papers_out(code), papers_out(code),
+        list_author_outputs, get_paper, (code, ), list_new_outputs, corpus_out())
+
+# Fetches the papers of the authors not done yet, listing the next authors while the papers of the first ones are fetched
+def fetch_papers(code):
+    paper_crawl(code).fetch_papers()
+
+# Fetches again the papers that failed in previous runs and adds them to the journal,
+# without crawling the whole institution again
+# Returns the urls of the papers recovered, for refresh_papers() (they were listed before the last crawl)
+def replay_papers(code):
+    return paper_crawl(code).replay_papers()
+
+# Incremental refresh: lists the research outputs of all authors up to the papers found in previous runs,
+# fetches only the new papers, and merges them into the papers file without merging all papers again
+# (as Pure lists research outputs newest first, only the first page of most authors is fetched)
+# The papers recovered by replay_papers() (urls in recovered) are merged too
+def refresh_papers(code, recovered=()):
+    paper_crawl(code).refresh_papers(recovered)
+
+##################################################
+# Eliminating duplicates
+##################################################
+
+def clean_duplicates(code, parquet=False):
+    paper_crawl(code).clean_duplicates(papers_parquet_out(code) if parquet else None)
+
+# Writes the unique papers to a Parquet dataset (requires pyarrow), partitioned by organisation and year
+def write_papers_parquet(code):
+    paper_crawl(code).write_papers_parquet(papers_parquet_out(code))
+
+##################################################
+# Corpus store
+##################################################
+
+# Saves the authors and the papers of an institution in the corpus store, in large transactions
+# Only the papers listed after since (see ProgressStore.last_link()) and those in urls if given: the others are already stored
+def load_corpus(code, since=0, urls=()):
+    paper_crawl(code).load_corpus(since, urls)
+
+# Finds the papers of all the institutions in the corpus store (including those of the other scrapers)
+# whose title and abstract are near-duplicates, e.g. the same paper listed under different urls on a Pure portal and on ePrints,
+# with MinHash and LSH (see common/neardup.py). Saves the clusters of near-duplicates in a CSV file, one row per paper
+def find_near_duplicate_papers(threshold=0.8, outFileName='data/papers_near_duplicates.csv'):
+    corpus = CorpusStore(corpus_out())
+    index = NearDuplicateIndex(threshold, shingle_size=3) # titles and abstracts are short
+    index.add_texts(((p['organisation'], p['url'], p['title']), p['title']+' '+p['abstract']) for p in corpus.papers())
+    corpus.close()
+    index.report()
+    with open(outFileName, 'w', encoding='utf-8', newline='') as outFile:
+        write_csv(outFile, ({'cluster':i, 'organisation':o, 'url':u, 'title':t}
+            for i, cluster in enumerate(index.clusters(), 1) for o, u, t in cluster))
+
+##################################################
+# Crawling
+##################################################
+
+# Runs all the steps for an institution
+# The authors are only fetched if missing, so their ids do not change when resuming an interrupted run
+# With replay_failed, the papers that failed in previous runs are fetched again first
+# (authors whose listing failed are never recorded, so they are always listed again)
+# With refresh, a previous crawl is updated with the papers published since (see refresh_papers())
+# With parquet, the unique papers are also written to a Parquet dataset (see write_papers_parquet())
+def crawl(code, replay_failed=False, refresh=False, parquet=False):
+    if not os.path.exists(auth_out(code)):
+        fetch_authors(code)
+    recovered = replay_papers(code) if replay_failed else set()
+    if refresh and os.path.exists(papers_out(code)):
+        refresh_papers(code, recovered)
+        if parquet:
+            write_papers_parquet(code)
+    else:
+        fetch_papers(code)
+        clean_duplicates(code, parquet)
+        load_corpus(code)
+
+# Crawls several institutions at once, in one process sharing the same connection pool and parsing processes
+def crawl_all(codes, replay_failed=False, refresh=False, parquet=False):
+    start_time = time.monotonic()
+    get_fetcher() # created before the threads share it
+    with ThreadPoolExecutor(len(codes)) as pool:
+        for f in [pool.submit(crawl, c, replay_failed, refresh, parquet) for c in codes]:
+            f.result()
+    get_fetcher().report()
+    paper_dates.report('publication dates')
+    print('Time taken (s): ', (time.monotonic() - start_time))
+
+# python pure.py [--replay] [--refresh] [--parquet] [code ...]
+if __name__ == '__main__':
+    codes = [a for a in sys.argv[1:] if not a.startswith('--')]
+    crawl_all(codes if len(codes) > 0 else list(institutions.keys()), '--replay' in sys.argv, '--refresh' in sys.argv,
+        '--parquet' in sys.argv)
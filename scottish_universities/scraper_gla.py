@@ -1,13 +1,23 @@
-import requests
-from bs4 import BeautifulSoup
 import csv
 import re
-from datetime import datetime
-import multiprocessing as mp
 import time
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common.fetcher import configure, get_fetcher
+from common.cache import ResponseCache
+from common.deadletters import DeadLetterStore
+from common.parsing import make_soup, make_strainer
+from common.text import normalise
+from common.dates import paper_dates
+from common.papers import PaperCrawl
 
 start_time = time.monotonic()
 
+# revalidates pages fetched in previous runs instead of downloading them again,
+# and records the papers that failed so they can be replayed (see replay_papers())
+configure(cache=ResponseCache('data/cache'), dead_letters=DeadLetterStore('data/gla_failed.db'))
+
 orga = 'University of Glasgow'
 
 ##################################################
@@ -37,21 +47,20 @@ def format_author_name(name):
         new_name = new_name[3:]
     return new_name
 
-def fetch_authors_page(url):
-    print('Fetching authors from %s'%(url))
-    text = requests.get(url).text
-    soup = BeautifulSoup(text, 'html.parser')
+def fetch_authors_page(url, text):
+    soup = make_soup(text, make_strainer(id=['eprints_content']))
     authors = soup.find(id='eprints_content').find('table').find_all('li')
-    return [{'id':new_id(), 'name':format_author_name(a.find('a').text), 'url':'https://eprints.gla.ac.uk/view/author/'+a.find('a')['href'], 'organisation':orga} for a in authors]
+    return [{'name':format_author_name(a.find('a').text), 'url':'https://eprints.gla.ac.uk/view/author/'+a.find('a')['href'], 'organisation':orga} for a in authors]
 
 def fetch_authors():
-    authors = []
-    for i in range(ord('A'), ord('Z')+1):
-        authors += fetch_authors_page(base_url_auth+chr(i)+'.html')
-    for s in ['=D6', '==017D']: # additional characters
-        authors += fetch_authors_page(base_url_auth+s+'.html')
+    letters = [chr(i) for i in range(ord('A'), ord('Z')+1)]
+    letters += ['=D6', '==017D'] # additional characters
+    pages = get_fetcher().map([base_url_auth+l+'.html' for l in letters], fetch_authors_page)
+    if len(pages) < len(letters): # the authors' ids must not change once saved
+        raise RuntimeError('%i of %i pages of authors failed, run again to fetch all authors'%(len(letters)-len(pages), len(letters)))
+    authors = [{'id':new_id(), **a} for p in pages for a in p]
     print('Found %i profiles'%len(authors))
-    with open(auth_out, 'w') as outFile:
+    with open(auth_out, 'w', encoding='utf-8', newline='') as outFile:
         w = csv.DictWriter(outFile, authors[0].keys(), quoting=csv.QUOTE_ALL)
         w.writeheader()
         w.writerows(authors)
@@ -62,71 +71,29 @@ def fetch_authors():
 # Scraping Papers
 ##################################################
 
-raw_papers_out = 'data/gla_papers_raw/gla_papers_raw'
-
-def distributed_fetch(urls, fetch_callback):
-    results = []
-    def process_result(r):
-        results.append(r)
-    pool = mp.Pool(mp.cpu_count())
-    for url in urls:
-        pool.apply_async(fetch_callback, args=(url, ), callback=process_result)
-    pool.close()
-    pool.join()
-    print('Found %i results'%len(results))
-    if len(results) < 1:
-        exit(1) # stop if no result to check issue
-    return results
-
-def clean_html(text):
-    clean_tags = re.compile('<.*?>')
-    clean_whitespace = re.compile('\s+')
-    clean_quotation = re.compile('”|“|"|’|‘')
-    return re.sub(clean_whitespace, ' ', 
-        re.sub(clean_quotation, ' ',
-        re.sub(clean_tags, ' ', text))).strip()
-    
+# journal of the authors and papers already fetched, to resume an interrupted run
+progress_out = 'data/gla_papers_raw/gla_progress.db'
+raw_papers_out = 'data/gla_papers_raw/gla_papers_raw.csv'
+papers_out = 'data/gla_papers.csv'
+papers_parquet_out = 'data/gla_papers.parquet'
+corpus_out = 'data/corpus.db'
+
 def get_text(dom_elt):
     if dom_elt != None:
-        return clean_html(str(dom_elt))
+        return normalise(str(dom_elt), strip=True)
     else:
         return ''
 
+# Returns the year in brackets in a citation, '' if none
 def get_year(s):
     m = re.search('\(([0-9]{4}?)\)', s)
-    if m:
-        return m.group(1)
+    return m.group(1) if m else ''
 
-def parse_date(date):
-    if date == '':
-        return date
-    else:
-        try:
-            datetime.strptime(date, '%Y')
-            return date
-        except ValueError:
-            try:
-                d = datetime.strptime(date, '%b %Y')
-                return d.date().strftime('%Y')
-            except ValueError:
-                try:
-                    d = datetime.strptime(date, '%d %b %Y')
-                    return d.date().strftime('%Y')
-                except ValueError:
-                    try:
-                        d = datetime.strptime(date, '%d %B %Y')
-                        return d.date().strftime('%Y')
-                    except ValueError:
-                        try:
-                            d = datetime.strptime(date, '%d/%m/%y')
-                            return d.date().strftime('%Y')
-                        except ValueError:
-                            print('Unrecognised date format: %s'%date)
-                            return date
-
-def get_paper(url):
-    text = requests.get(url).text
-    soup = BeautifulSoup(text, 'html.parser')
+# only the elements get_paper() reads are parsed
+paper_strainer = make_strainer(id=['eprints_content'])
+
+def get_paper(url, text):
+    soup = make_soup(text, paper_strainer)
     content = soup.find(id='eprints_content')
     title = get_text(content.find('h1'))
     summary = content.find(class_='ep_summary_content_main')
@@ -134,95 +101,78 @@ def get_paper(url):
     abstract = get_text(abst.find_next('p')) if abst != None else ''
     authors = get_text(content.find(string="Authors:").find_next('td'))
     cite = get_text(summary.find('p', class_='ep_block'))
-    date = parse_date(get_year(cite))
+    date = get_year(cite) # converted by parse_year()
     return {'title':title,'authors':authors,'date':date,'abstract':abstract,'url':url,'organisation':orga}
 
-def get_author_papers(auth_url, auth_id):
-    print('Starting author %s'%auth_id)
-    text = requests.get(auth_url).text
-    soup = BeautifulSoup(text, 'html.parser')
+# Yields the urls of the papers listed on an author's page (a single page, see fetch_authors_papers() in common/papers.py)
+def list_author_outputs(auth_url):
+    text = get_fetcher().get(auth_url)
+    soup = make_soup(text, make_strainer(class_=['ep_view_page_view_author']))
     papers = [p for p in soup.find(class_='ep_view_page_view_author').find_all('p', recursive=False)]
-    paper_urls = [p.find('a', recursive=False)['href'] for p in papers]
-    if(len(paper_urls)>0):
-        papers = distributed_fetch(paper_urls, get_paper)
-        for p in papers:
-            p['author_id'] = auth_id
-    else:
-        print('No publications')
-    return papers
+    yield [p.find('a', recursive=False)['href'] for p in papers]
 
+# Crawl of the papers (journal, replay, refresh, duplicates and corpus store), see common/papers.py
+paper_crawl = PaperCrawl(auth_out, progress_out, raw_papers_out, papers_out, list_author_outputs, get_paper, corpus_path=corpus_out)
+
+# Fetches the papers of the authors not done yet, listing the next authors while the papers of the first ones are fetched,
+# and exports the papers recorded in the journal to raw_papers_out
 def fetch_papers():
-    with open(auth_out, 'r') as inFile:
-        author_urls = [(row['url'],row['id']) for row in csv.DictReader(inFile)]
-        papers = []
-        for i,a_u in enumerate(author_urls):
-            if i > 5199: # where last execution stopped
-                papers += get_author_papers(a_u[0], a_u[1])
-                if((i+1)%100 == 0):
-                    with open(raw_papers_out+'_'+str(i)+'.csv', 'w') as outFile:
-                        w = csv.DictWriter(outFile, papers[0].keys(), quoting=csv.QUOTE_ALL)
-                        w.writeheader()
-                        w.writerows(papers)
-                        papers = []
-        with open(raw_papers_out+'_last.csv', 'w') as outFile:
-            w = csv.DictWriter(outFile, papers[0].keys(), quoting=csv.QUOTE_ALL)
-            w.writeheader()
-            w.writerows(papers)
-            papers = []
-
-# fetch_papers()
+    paper_crawl.fetch_papers()
+
+# Fetches again the papers that failed in previous runs and adds them to the journal
+# Returns the urls of the papers recovered, for refresh_papers()
+def replay_papers():
+    return paper_crawl.replay_papers()
+
+# python scraper_gla.py [--replay] [--refresh] [--parquet]
+# With --refresh, a previous crawl is updated with the papers published since (see refresh_papers())
+# With --parquet, the unique papers are written to a Parquet dataset too (see clean_duplicates())
+refresh = '--refresh' in sys.argv
+parquet = '--parquet' in sys.argv
+recovered = replay_papers() if '--replay' in sys.argv else set()
+if not refresh:
+    fetch_papers()
 
 ##################################################
-# Merge raw papers
+# Corpus store
 ##################################################
 
-raw_papers_out_merged = 'data/gla_papers_raw/gla_papers_raw.csv'
-
-def merge_raw_papers():
-    papers = []
-    for i in range(99, 14000, 100): # custom range to fit with split files
-        with open(raw_papers_out+'_'+str(i)+'.csv', 'r') as inFile:
-            p = [{k:v for k,v in r.items()} for r in csv.DictReader(inFile)]
-            print('%i papers found'%len(p))
-            papers += p
-    with open(raw_papers_out+'_last.csv', 'r') as inFile:
-        p = [{k:v for k,v in r.items()} for r in csv.DictReader(inFile)]
-        print('%i papers found'%len(p))
-        papers += p
-    print('%i papers found in total'%len(papers))
-    with open(raw_papers_out_merged, 'w') as outFile:
-        w = csv.DictWriter(outFile, papers[0].keys(), quoting=csv.QUOTE_ALL)
-        w.writeheader()
-        w.writerows(papers)
+# Saves the authors and the papers of the crawl in the corpus store shared by the scrapers
+# Only the papers listed after since (see ProgressStore.last_link()) and those in urls if given: the others are already stored
+def load_corpus(since=0, urls=()):
+    paper_crawl.load_corpus(since, urls)
 
-# merge_raw_papers()
+if not refresh:
+    load_corpus()
 
 ##################################################
 # Eliminating duplicates
 ##################################################
 
-papers_out = 'data/gla_papers.csv'
-
-def clean_duplicates():
-    with open(raw_papers_out_merged, 'r') as inFile:
-        papers = [{k:v for k,v in r.items()} for r in csv.DictReader(inFile)]
-        print('%i papers originally'%len(papers))
-        uniq_urls = {p['url'] for p in papers}
-        duplicate_papers = []
-        for u in uniq_urls:
-            duplicate_papers += [[p for p in papers if u == p['url']]]
-        uniq_papers = []
-        for p in duplicate_papers:
-            paper = p[0]
-            paper['author_ids'] = ' & '.join([d['author_id'] for d in p])
-            paper.pop('author_id', None)
-            uniq_papers += [paper]
-        print('Found %i unique papers'%len(uniq_papers))
-        with open(papers_out, 'w') as outFile:
-            w = csv.DictWriter(outFile, uniq_papers[0].keys(), quoting=csv.QUOTE_ALL)
-            w.writeheader()
-            w.writerows(uniq_papers)
+# With parquet, the unique papers are also written to a Parquet dataset (requires pyarrow), partitioned by organisation and year
+def clean_duplicates(parquet=False):
+    paper_crawl.clean_duplicates(papers_parquet_out if parquet else None)
 
 # clean_duplicates()
 
+##################################################
+# Incremental refresh
+##################################################
+
+# Lists the papers of all authors again (one page per author), fetches only the papers not listed in previous runs,
+# and merges them, with the papers recovered by replay_papers() (urls in recovered), into the papers file
+# without merging all papers again (the papers file is made by clean_duplicates() if missing)
+def refresh_papers(recovered=()):
+    paper_crawl.refresh_papers(recovered)
+
+if refresh:
+    refresh_papers(recovered)
+if parquet:
+    if refresh:
+        paper_crawl.write_papers_parquet(papers_parquet_out)
+    else:
+        clean_duplicates(parquet)
+
+get_fetcher().report()
+paper_dates.report('publication dates')
 print('Time taken (s): ', (time.monotonic() - start_time))
\ No newline at end of file
@@ -1,17 +1,24 @@
-import requests
-from bs4 import BeautifulSoup
 import csv
-import re
-from datetime import datetime
-import multiprocessing as mp
 import time
+import os
+import sys
+from urllib.parse import urljoin, urldefrag
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common.fetcher import configure, get_fetcher
+from common.cache import ResponseCache
+from common.deadletters import DeadLetterStore
+from common.parsing import make_soup, make_strainer
+from common.text import normalise
+from common.dates import paper_dates
+from common.papers import PaperCrawl
+from common.pagination import find_last_page, last_linked_page, listing_probe
 
-"""
-Make sure to check the n_pages_auth
-This is the total number of pages that has profiles
-"""
 start_time = time.monotonic()
 
+# revalidates pages fetched in previous runs instead of downloading them again,
+# and records the papers that failed so they can be replayed (see replay_papers())
+configure(cache=ResponseCache('data/cache'), dead_letters=DeadLetterStore('data/stir_failed.db'))
+
 orga = 'University of Stirling'
 
 ##################################################
@@ -19,7 +26,6 @@ orga = 'University of Stirling'
 ##################################################
 
 base_url_auth = 'https://www.stir.ac.uk/people/?page='
-n_pages_auth = 1
 auth_out = 'data/stir_authors.csv'
 
 curr_id = -1
@@ -29,17 +35,22 @@ def new_id():
     curr_id += 1
     return 'STIR%i'%curr_id
 
-def fetch_authors_page(url):
-    print('Fetching authors from %s'%(url))
-    text = requests.get(url).text
-    soup = BeautifulSoup(text, 'html.parser')
+def fetch_authors_page(url, text):
+    soup = make_soup(text, make_strainer(class_=['c-staff-overview']))
     authors = soup.find_all(class_='c-staff-overview')
-    return [{'id':new_id(), 'name':a.find('a').text, 'url':'https://www.stir.ac.uk/' + a.find('a')['href'], 'organisation':orga} for a in authors]
+    return [{'name':a.find('a').text, 'url':'https://www.stir.ac.uk/' + a.find('a')['href'], 'organisation':orga} for a in authors]
+
+# Finds the number of pages that have profiles, from the pagination links of the first page
+def count_authors_pages():
+    return find_last_page(listing_probe(base_url_auth, fetch_authors_page), 0, last_linked_page(get_fetcher().get(base_url_auth+'0'))) + 1
 
 def fetch_authors():
-    authors = []
-    for i in range(n_pages_auth):
-        authors += fetch_authors_page(base_url_auth+str(i))
+    n_pages_auth = count_authors_pages()
+    print('Fetching authors from %i pages'%n_pages_auth)
+    pages = get_fetcher().map([base_url_auth+str(i) for i in range(n_pages_auth)], fetch_authors_page)
+    if len(pages) < n_pages_auth: # the authors' ids must not change once saved
+        raise RuntimeError('%i of %i pages of authors failed, run again to fetch all authors'%(n_pages_auth-len(pages), n_pages_auth))
+    authors = [{'id':new_id(), **a} for p in pages for a in p]
     print('Found %i profiles'%len(authors))
     with open(auth_out, 'w', encoding='utf-8', newline='') as outFile:
         w = csv.DictWriter(outFile, authors[0].keys(), quoting=csv.QUOTE_ALL)
@@ -53,146 +64,110 @@ def fetch_authors():
 # Scraping Papers
 ##################################################
 
-research_output_page = '#outputs'
+# journal of the authors and papers already fetched
+progress_out = 'data/stir_progress.db'
 raw_papers_out = 'data/stir_papers_raw.csv'
-
-def distributed_fetch(urls, fetch_callback):
-    results = []
-    def process_result(r):
-        results.append(r)
-    pool = mp.Pool(mp.cpu_count())
-    for url in urls:
-        pool.apply_async(fetch_callback, args=(url, ), callback=process_result)
-    pool.close()
-    pool.join()
-    print('Found %i results'%len(results))
-    return results
-
-def clean_html(text):
-    clean_tags = re.compile('<.*?>')
-    clean_whitespace = re.compile('\s+')
-    clean_quotation = re.compile('”|“|"|’|‘')
-    return re.sub(clean_whitespace, ' ', 
-        re.sub(clean_quotation, ' ',
-        re.sub(clean_tags, ' ', text))).strip()
+papers_out = 'data/stir_papers.csv'
+papers_parquet_out = 'data/stir_papers.parquet'
+corpus_out = 'data/corpus.db'
 
 def get_text(dom_elt):
     if dom_elt != None:
-        return clean_html(str(dom_elt))
+        return normalise(str(dom_elt), strip=True)
     else:
         return ''
 
-def parse_date(date):
-    if date == '':
-        return date
-    else:
-        try:
-            datetime.strptime(date, '%Y')
-            return date
-        except ValueError:
-            try:
-                d = datetime.strptime(date, '%b %Y')
-                return d.date().strftime('%Y')
-            except ValueError:
-                try:
-                    d = datetime.strptime(date, '%d %b %Y')
-                    return d.date().strftime('%Y')
-                except ValueError:
-                    try:
-                        d = datetime.strptime(date, '%d %B %Y')
-                        return d.date().strftime('%Y')
-                    except ValueError:
-                        try:
-                            d = datetime.strptime(date, '%d/%m/%y')
-                            return d.date().strftime('%Y')
-                        except ValueError:
-                            print('Unrecognised date format: %s'%date)
-                            return date
-
-def get_paper(url):
-    text = requests.get(url).text
-    soup = BeautifulSoup(text, 'html.parser')
+# only the elements get_paper() reads are parsed
+paper_strainer = make_strainer(['dc_title'], class_=['dc_contributor_author', 'dc_description_abstract', 'status'])
+
+def get_paper(url, text):
+    soup = make_soup(text, paper_strainer)
     title = get_text(soup.find('dc_title'))
     authors = get_text(soup.find(class_='dc_contributor_author'))
     abstract = get_text(soup.find(class_='dc_description_abstract'))
     status = soup.find(class_='status')
-    date = parse_date(get_text(status.find(class_='dc_date_issued')))
+    date = get_text(status.find(class_='dc_date_issued')) # converted by parse_year()
     return {'title':title,'authors':authors,'date':date,'abstract':abstract,'url':url,'organisation':orga}
 
 
-def get_author_papers(auth_url, auth_id):
-    print('Starting author %s'%auth_id)
-    print(auth_url)
-    i = 0
-    paper_urls = []
-    paper_urls_temp = []
-    while True:
-        text = requests.get(auth_url+research_output_page+str(i)).text
-        soup = BeautifulSoup(text, 'html.parser')
-        papers = [p for p in soup.find_all('p', {'class': True}) if 'c-search-result__link' in p['class']]
-        if len(papers) == 0:
-            break
-        else:
-            paper_urls_temp += [p.find('a')['href'] for p in papers]
-            i += 1
-    for url in paper_urls_temp:
-        print(url)
-        if 'c-link' in url['class']:
-            print(url.find('a')['href'])
-            paper_urls.append(url.find('a')['href'])
-            print('***************** paper_urls *******************')
-            print(paper_urls)
-        else:
-            print('no links found')
-    papers = distributed_fetch(paper_urls, get_paper)
-    for p in papers:
-        p['author_id'] = auth_id
-    return papers
-
+# Returns the urls of the papers listed on a page of an author's research outputs,
+# and the url of the next page (None on the last page)
+def get_output_urls(url, text):
+    soup = make_soup(text, make_strainer(class_=['c-search-result__link'], rel=['next']))
+    links = [a for p in soup.find_all(class_='c-search-result__link') for a in p.find_all('a', class_='c-link')]
+    next_link = soup.find('a', rel='next')
+    next_page = urldefrag(urljoin(url, next_link['href']))[0] if next_link != None and next_link.get('href') else None
+    return [urljoin(url, a['href']) for a in links if a.get('href')], next_page
+
+# Yields the urls of the papers listed on each of an author's pages of research outputs,
+# following the link to the next page from each page (the #outputs tab is paginated by the query string)
+# Raises an exception if a page fails, so the author is not recorded with an incomplete listing
+def list_author_outputs(auth_url):
+    seen = set()
+    url = auth_url
+    while url != None and url not in seen:
+        seen.add(url)
+        urls, url = get_output_urls(url, get_fetcher().get(url))
+        yield urls
+
+# Crawl of the papers (journal, replay, refresh, duplicates and corpus store), see common/papers.py
+paper_crawl = PaperCrawl(auth_out, progress_out, raw_papers_out, papers_out, list_author_outputs, get_paper, corpus_path=corpus_out)
+
+# Fetches the papers of the authors not done yet, listing the next authors while the papers of the first ones are fetched
 def fetch_papers():
-    with open(auth_out, 'r', encoding='utf-8') as inFile:
-        author_urls = [(row['url'],row['id']) for row in csv.DictReader(inFile)]
-        papers = []
-        for a_u in author_urls:
-            papers += get_author_papers(a_u[0], a_u[1])
-        with open(raw_papers_out, 'w', encoding='utf-8', newline='') as outFile:
-            w = csv.DictWriter(outFile, papers[0].keys(), quoting=csv.QUOTE_ALL)
-            w.writeheader()
-            w.writerows(papers)
-
+    paper_crawl.fetch_papers()
 
+# Fetches again the papers that failed in previous runs and adds them to the journal
+# Returns the urls of the papers recovered, for refresh_papers()
+def replay_papers():
+    return paper_crawl.replay_papers()
 
 ##################################################
-# Eliminating duplicates
+# Corpus store
 ##################################################
 
-papers_out = 'data/stir_papers.csv'
+# Saves the authors and the papers of the crawl in the corpus store shared by the scrapers
+# Only the papers listed after since (see ProgressStore.last_link()) and those in urls if given: the others are already stored
+def load_corpus(since=0, urls=()):
+    paper_crawl.load_corpus(since, urls)
 
-def clean_duplicates():
-    with open(raw_papers_out, 'r', encoding='utf-8') as inFile:
-        papers = [{k:v for k,v in r.items()} for r in csv.DictReader(inFile)]
-        print('%i papers originally'%len(papers))
-        uniq_urls = {p['url'] for p in papers}
-        duplicate_papers = []
-        for u in uniq_urls:
-            duplicate_papers += [[p for p in papers if u == p['url']]]
-        uniq_papers = []
-        for p in duplicate_papers:
-            paper = p[0]
-            paper['author_ids'] = ' & '.join([d['author_id'] for d in p])
-            paper.pop('author_id', None)
-            uniq_papers += [paper]
-        print('Found %i unique papers'%len(uniq_papers))
-        with open(papers_out, 'w', encoding='utf-8', newline='') as outFile:
-            w = csv.DictWriter(outFile, uniq_papers[0].keys(), quoting=csv.QUOTE_ALL)
-            w.writeheader()
-            w.writerows(uniq_papers)
+##################################################
+# Eliminating duplicates
+##################################################
 
+# With parquet, the unique papers are also written to a Parquet dataset (requires pyarrow), partitioned by organisation and year
+def clean_duplicates(parquet=False):
+    paper_crawl.clean_duplicates(papers_parquet_out if parquet else None)
 
+##################################################
+# Incremental refresh
+##################################################
 
+# Lists the papers of all authors again, fetches only the papers not listed in previous runs,
+# and merges them, with the papers recovered by replay_papers() (urls in recovered), into the papers file
+# without merging all papers again
+def refresh_papers(recovered=()):
+    paper_crawl.refresh_papers(recovered)
 
+# python scraper_stirling.py [--replay] [--refresh] [--parquet]
+# The authors are only fetched if missing, so their ids (keys of the journal) do not change when resuming an interrupted run
+# With --refresh, a previous crawl is updated with the papers published since (see refresh_papers())
+# With --parquet, the unique papers are written to a Parquet dataset too (see clean_duplicates())
 if __name__ == '__main__':
-    fetch_authors()
-    fetch_papers()
+    parquet = '--parquet' in sys.argv
+    if not os.path.exists(auth_out):
+        fetch_authors()
+    recovered = replay_papers() if '--replay' in sys.argv else set()
+    if '--refresh' in sys.argv and os.path.exists(papers_out):
+        refresh_papers(recovered)
+        if parquet:
+            paper_crawl.write_papers_parquet(papers_parquet_out)
+    else:
+        fetch_papers()
+        load_corpus()
+        if parquet:
+            clean_duplicates(parquet)
     #clean_duplicates()
+    get_fetcher().report()
+    paper_dates.report('publication dates')
     print('Time taken (s): ', (time.monotonic() - start_time))
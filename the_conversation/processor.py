@@ -1,12 +1,18 @@
-import json
 import csv
 import os
 from datetime import datetime
-from collections import defaultdict, Counter
-import re
+from collections import Counter, deque
 import multiprocessing as mp
-from langdetect import detect
+import sys
+from langdetect import DetectorFactory, detect
+from langdetect.detector_factory import init_factory
 from langdetect.lang_detect_exception import LangDetectException
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common.sinks import JSONLinesSink, CSVSink, read_jsonl, write_csv, open_text, concat_csv
+from common.text import normalise
+from common.columnar import write_parquet
+from common.corpus import CorpusStore
+from common.neardup import NearDuplicateIndex
 
 # Function reading a date string and formating it to just the year
 def transform_date_year(dateString):
@@ -15,103 +21,197 @@ def transform_date_year(dateString):
     else:
         return datetime.strptime(dateString, '%Y-%m-%d').date().strftime('%Y')
 
-# Cleans a string from all HTML tags,
-# remove all quote characters (exc. apostrophes),
-# and set all whitespaces to a single space character
-def clean_text(text):
-    clean_tags = re.compile('<.*?>')
-    clean_whitespace = re.compile('\s+')
-    clean_quotation = re.compile('”|“|"|’|‘')
-    return re.sub(clean_whitespace, ' ', 
-        re.sub(clean_quotation, ' ',
-        re.sub(clean_tags, ' ', text)))
-
 # List of editions
 countries = ['uk','global','au','us','ca']
 
 # Function printing any duplicate articles
-def find_duplicates():
-    ids = []
+# With corpus, the duplicates are found in the corpus store (see load_corpus()) with an indexed query instead
+def find_duplicates(corpus=False):
+    if corpus:
+        store = CorpusStore(corpus_out())
+        print(store.duplicate_articles())
+        store.close()
+        return
+    ids = Counter()
     for c in countries:
-        with open('data/articlesEdition/articles_%s.json'%c, 'r') as inFile:
-            data = json.load(inFile)
-            ids += [d['id'] for d in data]
-    print([(u,cnt) for u, cnt in Counter(ids).items() if cnt > 1])
+        ids.update(d['id'] for d in read_jsonl('data/articlesEdition/articles_%s.jsonl'%c))
+    print([(u,cnt) for u, cnt in ids.items() if cnt > 1])
+
+# Function finding the articles of editions whose title and text are near-duplicates (e.g. a story republished
+# in several editions under a new id), with MinHash and LSH (see common/neardup.py) in time linear in the number of articles
+# Saves the clusters of near-duplicates in a CSV file, one row per article with the number of its cluster
+def find_near_duplicates(editions=countries, threshold=0.8, outFileName='data/near_duplicates.csv'):
+    index = NearDuplicateIndex(threshold)
+    index.add_texts(((d['edition'], d['id'], d['url']), d['title']+' '+' '.join(d['text'])) for _, _, d in read_editions(editions))
+    index.report()
+    with CSVSink(outFileName) as sink:
+        for i, cluster in enumerate(index.clusters(), 1):
+            for edition, id, url in cluster:
+                sink.write({'cluster':i, 'edition':edition, 'id':id, 'url':url})
 
-# Function spliting articles into separate JSON file: one file per edition and per year
-def split_by_year():
+# Function spliting articles into separate JSON Lines file: one file per edition and per year
+# With parquet, the articles are written instead to a single Parquet dataset partitioned by edition and year (requires pyarrow),
+# data/articlesParquet/edition=<edition name>/year=<year>/ (e.g. edition=UK/year=2019)
+def split_by_year(parquet=False):
+    if parquet:
+        counts = Counter()
+        def rows():
+            for c, y, d in read_editions(countries):
+                counts[c,y] += 1
+                yield dict(d, year=y)
+        write_parquet('data/articlesParquet', rows(), ('edition', 'year'))
+        for c in countries:
+            print('%s: %i articles'%(c,sum(n for (e,_), n in counts.items() if e == c)))
+            for (e,y), n in counts.items():
+                if e == c:
+                    print(' - %s: %i articles'%(y, n))
+        return
     for c in countries:
-        with open('data/articlesEdition/articles_%s.json'%c, 'r') as inFile:
-            data = json.load(inFile)
-            print('%s: %i articles'%(c,len(data)))
-            nested = defaultdict(list)
-            for d in data:
-                nested[transform_date_year(d['date'])].append(d)
-            for y in nested.keys():
-                print(' - %s: %i articles'%(y, len(nested[y])))
-                with open('data/articlesEditionYear/articles_%s_%s.json'%(c,y), 'w') as outFile:
-                    json.dump(nested[y], outFile)
-
-# Function changing year-edition JSON files into year-edition CSV file
+        sinks = {}
+        for d in read_jsonl('data/articlesEdition/articles_%s.jsonl'%c):
+            y = transform_date_year(d['date'])
+            if y not in sinks:
+                sinks[y] = JSONLinesSink('data/articlesEditionYear/articles_%s_%s.jsonl'%(c,y), append=False)
+            sinks[y].write(d)
+        print('%s: %i articles'%(c,sum(s.count for s in sinks.values())))
+        for y, s in sinks.items():
+            print(' - %s: %i articles'%(y, s.count))
+            s.close()
+
+# Function formatting an article for CSV: text and authors joined in a single string
+def csv_article(d):
+    return dict(d, text=normalise(' '.join(d['text'])), authors=' & '.join(d['authors']))
+
+# Function changing year-edition JSON Lines files into year-edition CSV file
 def format_csv():
     filePath = 'data/articlesEditionYear/'
     for f in os.listdir(filePath):
         fileName = f.split('.')[0]
-        with open(filePath+fileName+'.json', 'r') as inFile:
-            data = json.load(inFile)
-            for d in data:
-                d['text'] = clean_text(' '.join(d['text']))
-                d['authors'] = ' & '.join(d['authors'])
-            with open('data/articlesEditionYearCSV/'+fileName+'.csv', 'w') as outFile:
-                w = csv.DictWriter(outFile, data[0].keys(), quoting=csv.QUOTE_ALL)
-                w.writeheader()
-                w.writerows(data)
-
-# Function dividing articles from year-edition JSON files into sub-articles with length at least threshold words
-# Saves sub-articles in year-edition CSV files;
+        with open('data/articlesEditionYearCSV/'+fileName+'.csv', 'w') as outFile:
+            write_csv(outFile, (csv_article(d) for d in read_jsonl(filePath+f)))
+
+# Returns the (first, last) indices of the paragraphs of each sub-article, given the number of words of each paragraph:
+# a sub-article ends with the first paragraph bringing it to at least threshold words, the last one holds the words left
+def chunk_bounds(counts, threshold):
+    bounds = []
+    first = 0
+    n = 0
+    for i, c in enumerate(counts):
+        n += c
+        if n >= threshold:
+            bounds.append((first, i))
+            first = i+1
+            n = 0
+    if first < len(counts):
+        bounds.append((first, len(counts)-1))
+    return bounds
+
+# Function dividing an article into sub-articles with length at least threshold words, for each of thresholds in a single pass
+# Returns the sub-articles by threshold
+# The paragraphs are counted (words separated by a space) and joined once per article, whatever the number of thresholds,
+# and the text of each sub-article is sliced from the joined text at the offsets of its paragraphs
+# (see benchmarks/bench_chunking.py)
+def chunk_article(d, thresholds):
+    paragraphs = d['text']
+    counts = [t.count(' ')+1 for t in paragraphs]
+    body = ' '.join(paragraphs)
+    starts = []
+    offset = 0
+    for t in paragraphs:
+        starts.append(offset)
+        offset += len(t)+1
+    meta = {'url':d['url'], 'title':d['title'], 'date':d['date'], 'authors':' & '.join(d['authors']), 'edition':d['edition']}
+    chunks = {}
+    for threshold in thresholds:
+        chunks[threshold] = [{'id':'%s-%i'%(d['id'],i), **meta, 'text':body[starts[first]:starts[last]+len(paragraphs[last])]}
+            for i, (first, last) in enumerate(chunk_bounds(counts, threshold), 1)]
+    return chunks
+
+# Function dividing an article into sub-articles with length at least threshold words
+def divide_article(d, threshold):
+    return chunk_article(d, [threshold])[threshold]
+
+# Function dividing articles from year-edition JSON Lines files into sub-articles with length at least threshold words
+# Saves sub-articles in year-edition CSV files, for each threshold if given a list (e.g. [300, 400]): each file is read once
 def divide_docs(threshold):
+    thresholds = threshold if isinstance(threshold, (list, tuple)) else [threshold]
     filePath = 'data/articlesEditionYear/'
     for f in os.listdir(filePath):
         fileName = f.split('.')[0]
-        with open(filePath+fileName+'.json', 'r') as inFile:
-            data = json.load(inFile)
-            new_docs = []
-            for d in data:
-                i = 1
-                text = []
-                for t in d['text']:
-                    text += t.split(' ')
-                    if len(text) >= threshold:
-                        new_docs.append({
-                            'id':'%s-%i'%(d['id'],i), 'url':d['url'], 'title':d['title'], 'date':d['date'], 
-                            'authors':' & '.join(d['authors']), 'edition':d['edition'], 'text':' '.join(text)})
-                        i += 1
-                        text = []
-                if len(text) > 0:
-                        new_docs.append({
-                            'id':'%s-%i'%(d['id'],i), 'url':d['url'], 'title':d['title'], 'date':d['date'], 
-                            'authors':' & '.join(d['authors']), 'edition':d['edition'], 'text':' '.join(text)})
-            with open('data/articlesEditionYearCSV/%s_%i.csv'%(fileName,threshold), 'w') as outFile:
-                w = csv.DictWriter(outFile, new_docs[0].keys(), quoting=csv.QUOTE_ALL)
-                w.writeheader()
-                w.writerows(new_docs)
+        sinks = {t:CSVSink('data/articlesEditionYearCSV/%s_%i.csv'%(fileName,t)) for t in thresholds}
+        for d in read_jsonl(filePath+f):
+            for t, chunks in chunk_article(d, thresholds).items():
+                for s in chunks:
+                    sinks[t].write(s)
+        for s in sinks.values():
+            s.close()
 
 # Function merging multiple year-edition[-divided] CSV files into a single CSV file
+# Rows are streamed from the year-edition files to the merged file, whose columns are the union of theirs
+# The merged file is compressed with gzip if outFileName ends with .gz,
+# and is a Parquet dataset partitioned by edition and year if outFileName ends with .parquet (requires pyarrow)
 def merge_CSVs(editions, years, threshold=None, outFileName='data/articles.csv'):
     doc_words = '' if threshold == None else '_%i'%threshold
-    data = []
+    files = []
     for e in editions:
         for y in years:
-            try:
-                with open('data/articlesEditionYearCSV/articles_%s_%s%s.csv'%(e,y,doc_words), 'r') as inFile:
-                    data += [{k:v for k,v in row.items()} for row in csv.DictReader(inFile)]
-            except FileNotFoundError:
-                print('Skipping data/articlesEditionYearCSV/articles_%s_%s%s.csv: not found'%(e,y,doc_words))
-    with open(outFileName, 'w') as outFile:
-        w = csv.DictWriter(outFile, data[0].keys(), quoting=csv.QUOTE_ALL)
-        w.writeheader()
-        w.writerows(data)
-    
+            f = 'data/articlesEditionYearCSV/articles_%s_%s%s.csv'%(e,y,doc_words)
+            if os.path.exists(f):
+                files.append(f)
+            else:
+                print('Skipping %s: not found'%f)
+    if outFileName.endswith('.parquet'):
+        print('%i articles merged'%write_parquet(outFileName, csv_rows(files), ('edition', 'year'), csv_fields(files)+['year']))
+        return
+    with open_text(outFileName, 'w') as outFile:
+        print('%i articles merged'%concat_csv(files, outFile))
+
+# Returns the union of the columns of CSV files, in order of appearance
+def csv_fields(files):
+    fields = []
+    for f in files:
+        with open_text(f) as inFile:
+            fields += [k for k in next(csv.reader(inFile), []) if k not in fields]
+    return fields
+
+# Yields the rows of year-edition CSV files, with their year
+def csv_rows(files):
+    for f in files:
+        with open_text(f) as inFile:
+            for r in csv.DictReader(inFile):
+                r['year'] = transform_date_year(r['date'])
+                yield r
+
+##################################################
+# Corpus store
+##################################################
+
+def corpus_out():
+    return 'data/corpus.db'
+
+# Function loading the articles of editions into the corpus store (e.g. articles scraped before the scraper saved them there),
+# articles already stored are updated. With fts, their titles and texts are indexed for full-text search
+def load_corpus(editions=countries, fts=False):
+    store = CorpusStore(corpus_out(), fts)
+    for c in editions:
+        print('%s: %i articles'%(c, store.upsert_articles(read_jsonl('data/articlesEdition/articles_%s.jsonl'%c))))
+    for (e,y), n in sorted(store.count_articles().items()):
+        print(' - %s %s: %i articles'%(e, y, n))
+    store.close()
+
+# Function writing the articles of editions (named as in the articles, e.g. ['UK','US']) and years from the corpus store
+# into a single CSV file, as split_by_year(), format_csv()/divide_docs() and merge_CSVs() would, with a query on the
+# edition and year index instead of intermediate files. The file is compressed with gzip if outFileName ends with .gz
+def merge_corpus(editions, years, threshold=None, outFileName='data/articles.csv'):
+    store = CorpusStore(corpus_out())
+    articles = store.articles(editions, years)
+    with CSVSink(outFileName) as sink:
+        for d in articles:
+            for row in ([csv_article(d)] if threshold == None else divide_article(d, threshold)):
+                sink.write(row)
+    store.close()
+    print('%i articles merged'%sink.count)
+
 # Function detecting the language of string
 def detect_lang(s):
     try:
@@ -119,57 +219,138 @@ def detect_lang(s):
     except LangDetectException:
         return 'n/a'
 
-# Function detecting if the language of an article in English
-# does multiple tries and normalise result to account for stochastic prediction
-def detect_en_article(article):
-    tries = 2
-    count_en = 0
-    for _ in range(tries):
-        if detect_lang(article['text']) == 'en':
-            count_en += 1
-    en_cert = count_en/tries
-    if en_cert < 1:
-        print('Article %s - English: %f'%(article['id'],en_cert))
-    return (en_cert > 0.5, article['id'])
-
-# Consumer function for parallel detection of language across articles
-# Logs progess every 1000 article
-def classify_article(article, i, tot):
-    res = detect_en_article(article)
-    if i%1000 == 0:
-        print('%f done'%(i/tot))
-    return res
+# Initialises a language detection worker: loads the language profiles once, with the detector seeded
+# langdetect samples the text at random, with a fixed seed a text always gets the same language, so one detection is enough
+def init_detector():
+    DetectorFactory.seed = 0
+    init_factory()
+
+# Consumer function detecting the language of a chunk of texts
+# Returns one byte per text, set to 1 if the text is in English
+def classify_chunk(texts):
+    return bytes(detect_lang(t) == 'en' for t in texts)
+
+# Number of articles sent to a worker at once
+lang_chunk_size = 500
+
+# Pipeline stage detecting the language of rows (dictionaries with a 'text'), only on their first max_chars characters if given
+# Yields (row, True if the row is in English), in the order of the rows
+# Chunks of texts are sent to a pool of persistent workers, at most two chunks waiting per worker,
+# so only these chunks of rows are held in memory
+def classify_rows(rows, max_chars=None, chunk_size=lang_chunk_size):
+    n_workers = max(1, mp.cpu_count()-1)
+    pending = deque()
+    n_done = 0
+    with mp.Pool(n_workers, initializer=init_detector) as pool:
+        def submit(chunk):
+            texts = [r['text'] if max_chars == None else r['text'][:max_chars] for r in chunk]
+            pending.append((chunk, pool.apply_async(classify_chunk, (texts, ))))
+        chunk = []
+        for r in rows:
+            chunk.append(r)
+            if len(chunk) == chunk_size:
+                submit(chunk)
+                chunk = []
+            while len(pending) >= 2*n_workers:
+                done, result = pending.popleft()
+                for row, is_en in zip(done, result.get()):
+                    yield row, is_en == 1
+                n_done += len(done)
+                if n_done % (100*chunk_size) == 0:
+                    print('%i articles done'%n_done)
+        if len(chunk) > 0:
+            submit(chunk)
+        while len(pending) > 0:
+            done, result = pending.popleft()
+            for row, is_en in zip(done, result.get()):
+                yield row, is_en == 1
 
 # Function reading a CSV file and separating into two CSV files:
 # - one for English articles
 # - one for non-english articles
-def separate_non_english(csv_filename, en_filename, noen_filename):
-    noen_id = []
-    def process_result(r):
-        if not r[0]:
-            noen_id.append(r[1])
-    with open(csv_filename, 'r') as inFile:
-        articles = [{k:v for k,v in row.items()} for row in csv.DictReader(inFile)]
-        keys = articles[0].keys()
-        total_art = len(articles)
-        pool = mp.Pool(mp.cpu_count()-1)
-        for i,a in enumerate(articles):
-            pool.apply_async(classify_article, args=(a, i, total_art), callback=process_result)
-        pool.close()
-        pool.join()
-        en_art = [a for a in articles if not a['id'] in noen_id]
-        noen_art = [a for a in articles if a['id'] in noen_id]
-        print('Total articles: %i'%len(articles))
-        print('English articles: %i - Non-English articles: %i'%(len(en_art),len(noen_art)))
-        with open(en_filename, 'w') as outFile:
-            w = csv.DictWriter(outFile, keys, quoting=csv.QUOTE_ALL)
-            w.writeheader()
-            w.writerows(en_art)
-        with open(noen_filename, 'w') as outFile:
-            w = csv.DictWriter(outFile, keys, quoting=csv.QUOTE_ALL)
-            w.writeheader()
-            w.writerows(noen_art) 
+# The language is detected on the first max_chars characters of the articles if given (faster on long texts)
+# Files ending with .gz are read and written compressed
+def separate_non_english(csv_filename, en_filename, noen_filename, max_chars=None):
+    with open_text(csv_filename) as inFile:
+        reader = csv.DictReader(inFile)
+        with CSVSink(en_filename, reader.fieldnames) as en, CSVSink(noen_filename, reader.fieldnames) as noen:
+            for row, is_en in classify_rows(reader, max_chars):
+                (en if is_en else noen).write(row)
+    print('Total articles: %i'%(en.count+noen.count))
+    print('English articles: %i - Non-English articles: %i'%(en.count, noen.count))
+
+##################################################
+# Single-pass pipeline
+##################################################
 
+# Pipeline stage reading the articles of editions, yields (edition, year, article)
+def read_editions(editions):
+    for c in editions:
+        for d in read_jsonl('data/articlesEdition/articles_%s.jsonl'%c):
+            yield c, transform_date_year(d['date']), d
+
+# Pipeline stage keeping the articles of years (all if None)
+def select_years(articles, years):
+    for c, y, d in articles:
+        if years == None or y in years:
+            yield c, y, d
+
+# Function processing the articles in a single pass: each article is read once and written to all the outputs requested,
+# instead of each step reading the files written by the previous one
+# - editions, years: articles processed (all years if None);
+# - split: year-edition JSON Lines files, as split_by_year();
+# - to_csv: year-edition CSV files, as format_csv();
+# - thresholds: year-edition CSV files of sub-articles, as divide_docs() for each threshold;
+# - merged: single CSV file of the articles, or of their sub-articles if threshold is given, as merge_CSVs();
+# - separate: (English CSV file, non-English CSV file) of the same rows as merged, as separate_non_english() (with max_chars).
+# e.g. process_articles(['uk','us','ca','au'], ['2019','2018'], threshold=300, merged='data/articles.csv',
+#     separate=('data/articles_en.csv','data/articles_noen.csv'))
+# CSV files ending with .gz are compressed
+def process_articles(editions=countries, years=None, split=False, to_csv=False, thresholds=(), threshold=None,
+        merged=None, separate=None, max_chars=None):
+    sinks = {}
+    def sink(path, cls=CSVSink):
+        if path not in sinks:
+            sinks[path] = cls(path, append=False) if cls == JSONLinesSink else cls(path)
+        return sinks[path]
+
+    merging = merged != None or separate != None
+    sizes = set(thresholds) | ({threshold} if threshold != None and merging else set())
+
+    # stage writing the year-edition outputs, yields the rows of the merged outputs
+    # the articles of the other editions and years are dropped before, and an article is only formatted (csv_article())
+    # and chunked for the outputs requested
+    def fan_out(articles):
+        for c, y, d in articles:
+            if split:
+                sink('data/articlesEditionYear/articles_%s_%s.jsonl'%(c,y), JSONLinesSink).write(d)
+            row = csv_article(d) if to_csv or (merging and threshold == None) else None
+            if to_csv:
+                sink('data/articlesEditionYearCSV/articles_%s_%s.csv'%(c,y)).write(row)
+            chunks = chunk_article(d, sizes) if len(sizes) > 0 else {}
+            for t in thresholds:
+                for s in chunks[t]:
+                    sink('data/articlesEditionYearCSV/articles_%s_%s_%i.csv'%(c,y,t)).write(s)
+            if not merging:
+                continue
+            if threshold == None:
+                yield row
+            else:
+                yield from chunks[threshold]
+
+    rows = fan_out(select_years(read_editions(editions), years))
+    if separate != None:
+        for row, is_en in classify_rows(rows, max_chars):
+            if merged != None:
+                sink(merged).write(row)
+            sink(separate[0] if is_en else separate[1]).write(row)
+    else:
+        for row in rows:
+            if merged != None:
+                sink(merged).write(row)
+    for path, s in sorted(sinks.items()):
+        print('%s: %i rows'%(path, s.count))
+        s.close()
 
 # find_duplicates()
 # split_by_year()
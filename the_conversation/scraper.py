@@ -1,76 +1,87 @@
-from datetime import datetime
-import requests
-from bs4 import BeautifulSoup
 import json
-import multiprocessing as mp
-import re
-
-# Cleans a string from all HTML tags,
-# remove all quote characters (exc. apostrophes),
-# and set all whitespaces to a single space character
-def clean_html(text):
-    clean_tags = re.compile('<.*?>')
-    clean_whitespace = re.compile('\s+')
-    clean_quotation = re.compile('”|“|"|’|‘')
-    return re.sub(clean_whitespace, ' ', 
-        re.sub(clean_quotation, ' ',
-        re.sub(clean_tags, ' ', text)))
-
-# Given url will scrape article data and return it as dictionary
-def scrap_article(url, num, tot):
-    if num % 1000 == 0:
-        print('Article %i of %i'%(num,tot))
-    text = requests.get(url).text
-    soup = BeautifulSoup(text, 'html.parser')
+import aiohttp
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common.fetcher import configure, get_fetcher
+from common.cache import ResponseCache
+from common.deadletters import DeadLetterStore
+from common.parsing import make_soup, make_strainer
+from common.text import normalise
+from common.dates import DateParser
+from common.pagination import find_last_page, last_linked_page, listing_probe
+from common.dedup import merge_duplicates
+from common.index import KnownIndex
+from common.corpus import CorpusStore
+from common.sinks import JSONLinesSink, read_jsonl
+
+# revalidates pages fetched in previous runs instead of downloading them again,
+# and records the pages that failed so they can be replayed (see scrap_articles())
+configure(cache=ResponseCache('data/cache'), dead_letters=DeadLetterStore('data/failed.db'))
+
+# Only the elements scrap_article() reads are parsed
+article_strainer = make_strainer(id=['article'], class_=['entry-title', 'author-name'], itemprop=['datePublished', 'articleBody'])
+
+# Given url, page content and edition code will scrape article data and return it as dictionary
+# The edition is an argument so the articles that fail are recorded with it (see scrap_articles())
+def scrap_article(url, text, edition):
+    soup = make_soup(text, article_strainer)
     t = soup.find(class_='entry-title')
-    art_title = clean_html(t.text).strip() if t else ""
+    art_title = normalise(t.text, strip=True) if t else ""
     i = soup.find(id='article')['data-id']
     art_id = i if i else ""
     d = soup.find(itemprop='datePublished')
-    art_date = datetime.strptime(clean_html(d.text).strip(), '%B %d, %Y %I.%M%p %Z').date().strftime('%Y-%m-%d') if d else ""
+    art_date = normalise(d.text, strip=True) if d else "" # converted by get_articles()
     article = soup.find(itemprop='articleBody').find_all(['h2', 'p'])
-    art_text = [clean_html(a.text.strip()) for a in article]
+    art_text = [normalise(a.text.strip()) for a in article]
     authors = soup.findAll(class_='author-name')
-    art_auths = [clean_html(a.text.strip()) for a in authors]
-    return {'url':url, 'title':art_title, 'date':art_date, 'id':art_id, 'text':art_text, 'authors':art_auths}
-
-# Given a set of urls will fetch articles in parallel
-def get_articles(urls):
-    articles = []
-    def process_result(r):
-        articles.append(r)
-    pool = mp.Pool(mp.cpu_count())
-    for i, url in enumerate(urls):
-        pool.apply_async(scrap_article, args=(url, i, len(urls)), callback=process_result)
-    pool.close()
-    pool.join()
-    print('Found %i articles'%len(articles))
-    return articles
-
-# Given an index url will fetch the article urls listed there
-def get_articles_urls(url):
-    print('Fetching urls from %s'%(url))
-    text = requests.get(url).text
-    soup = BeautifulSoup(text, 'html.parser')
+    art_auths = [normalise(a.text.strip()) for a in authors]
+    return {'url':url, 'title':art_title, 'date':art_date, 'id':art_id, 'text':art_text, 'authors':art_auths, 'edition':c_name[edition]}
+
+# Publication dates, e.g. 'May 12, 2021 2.15pm UTC'
+# (or already converted, for the articles parsed by previous versions kept in the cache)
+article_dates = DateParser(['%B %d, %Y %I.%M%p %Z', '%Y-%m-%d'])
+
+# Returns the date of an article as 'YYYY-MM-DD', empty if not recognised
+def format_date(date):
+    d = article_dates.parse(date)
+    return d.strftime('%Y-%m-%d') if d != None else ""
+
+# Given a set of urls of an edition will fetch articles in parallel, yielding each article as soon as it is scraped
+# Dates are converted here rather than in the parsing processes, so the unrecognised ones are counted in one place
+def get_articles(urls, c):
+    for i, a in enumerate(get_fetcher().imap(urls, scrap_article, c)):
+        a['date'] = format_date(a['date'])
+        if i % 1000 == 0:
+            print('Article %i of %i'%(i,len(urls)))
+        yield a
+
+# Given an index url and page content will return the article urls listed there
+def get_articles_urls(url, text):
+    soup = make_soup(text, make_strainer(['article']))
     articles = soup.findAll('article')
     return [{'url':'https://theconversation.com'+a.find(class_='article--header').find('h2').find('a')['href'], 'id':a['data-id']} for a in articles]
 
-# Given info on an edition (name and number of index pages) will fetch all article urls for that edition
+# Finds the number of index pages of an edition (numbered from 1), from the pagination links of the first page
+def count_index_pages(url_base):
+    return find_last_page(listing_probe(url_base, get_articles_urls), 1, last_linked_page(get_fetcher().get(url_base+'1')))
+
+# Given an edition code will fetch all article urls for that edition
 def get_urls(country):
-    url_base = 'https://theconversation.com/%s/home-page/articles?page='%country[0]
-    article_urls = []
-    for i in range(1, country[1]+1):
-        article_urls += get_articles_urls(url_base+str(i))
-    with open('data/urls/urls_%s.json'%country[0], 'w') as out:
+    url_base = 'https://theconversation.com/%s/home-page/articles?page='%country
+    n_pages = count_index_pages(url_base)
+    print('Fetching urls from %i pages of edition %s'%(n_pages, country))
+    pages = get_fetcher().map([url_base+str(i) for i in range(1, n_pages+1)], get_articles_urls)
+    article_urls = [a for p in pages for a in p]
+    with open('data/urls/urls_%s_raw.json'%country, 'w') as out:
         json.dump(article_urls, out)
 
 
 # Main function retrieving all article urls
 def retrieve_urls():
-    countries = [['uk', 1131], ['au', 1561], ['ca', 158], ['us', 517], ['global', 28]]
-    pool = mp.Pool(mp.cpu_count()-1)
-    pool.map(get_urls, [c for c in countries])
-    pool.close()
+    os.makedirs('data/urls', exist_ok=True)
+    for country in ['uk', 'au', 'ca', 'us', 'global']:
+        get_urls(country)
 
 # Function checking article urls from all editions and removing possible duplicates
 def clean_duplicates():
@@ -78,30 +89,106 @@ def clean_duplicates():
     for c in countries:
         with open('data/urls/urls_%s_raw.json'%c, 'r') as inFile:
             data = json.load(inFile)
-            ids = []
-            urls = []
-            for d in data:
-                if d['id'] not in ids:
-                    ids.append(d['id'])
-                    urls.append(d['url'])
-            print('%s: %i articles'%(c,len(ids)))
+            _, uniq = merge_duplicates(data, 'id')
+            urls = [d['url'] for d in uniq]
+            print('%s: %i articles'%(c,len(urls)))
             with open('data/urls/urls_%s.json'%c, 'w') as outFile:
                 json.dump(urls, outFile)
 
+# Names of the editions, saved with their articles
+c_name = {'uk':'UK','au':'Australia','us':'US','ca':'Canada','global':'Global'}
+
+# Index of the ids of the articles already scraped, by edition, read by incremental crawls (see update_articles())
+def index_out():
+    return 'data/urls/index.db'
+
+def corpus_out():
+    return 'data/corpus.db'
+
+# Scrapes articles of an edition, appends them to its JSON Lines file (sink) and adds them to the index of known ids,
+# yields them to be saved in the corpus
+def saved_articles(urls, c, sink, index):
+    for a in get_articles(urls, c):
+        sink.write(a)
+        index.add(c, [a['id']])
+        yield a
+
 # Main function scraping all articles
-def scrap_articles():
-    # countries = ['uk','au','us','ca','global']
-    countries = ['us','ca','global','au']
-    c_name = {'uk':'UK','au':'Australia','us':'US','ca':'Canada','global':'Global'}
-    for c in countries:
-        with open('data/urls/urls_%s.json'%c, 'r') as inFile:
-            print('Starting %s'%c)
-            urls = json.load(inFile)
-            articles = get_articles(urls)
-            for a in articles:
-                a['edition'] = c_name[c]
-            with open('data/articlesEdition/articles_%s.json'%c, 'w') as outFile:
-                json.dump(articles, outFile)
-            print('Finished %s'%c)
+# Articles are appended to the edition's JSON Lines file as they are scraped,
+# so an interrupted run keeps its articles and the next run only scrapes the missing ones
+# With replay_failed, only the articles that failed in previous runs are scraped again, read from the dead letters of each edition
+# (so are those found by update_articles(), which are not in the urls files)
+# The articles are also saved in the corpus store (data/corpus.db, see load_corpus() in processor.py for articles scraped before)
+def scrap_articles(replay_failed=False):
+    index = KnownIndex(index_out())
+    corpus = CorpusStore(corpus_out(), batch_size=100)
+    for c in c_name:
+        print('Starting %s'%c)
+        if replay_failed:
+            urls = get_fetcher().dead_letters.urls('scrap_article', [c])
+        else:
+            with open('data/urls/urls_%s.json'%c, 'r') as inFile:
+                urls = json.load(inFile)
+        out = 'data/articlesEdition/articles_%s.jsonl'%c
+        done = {a['url'] for a in read_jsonl(out)} if os.path.exists(out) else set()
+        with JSONLinesSink(out) as sink:
+            corpus.upsert_articles(saved_articles([u for u in urls if u not in done], c, sink, index))
+            print('Found %i articles'%sink.count)
+        print('Finished %s'%c)
+    index.close()
+    corpus.close()
+    get_fetcher().report()
+    article_dates.report('article dates')
+
+# Number of consecutive known articles after which an incremental crawl stops walking an edition's index pages
+known_run = 50
+
+# Returns the urls of the new articles of an edition, by id, walking its index pages newest first
+# until known_run consecutive articles are known, or the last page
+def new_articles_urls(country, known):
+    url_base = 'https://theconversation.com/%s/home-page/articles?page='%country
+    new = {}
+    run = 0
+    page = 0
+    while run < known_run:
+        page += 1
+        url = url_base+str(page)
+        try:
+            articles = get_articles_urls(url, get_fetcher().get(url))
+        except aiohttp.ClientResponseError as e:
+            if e.status != 404:
+                raise
+            articles = []
+        if len(articles) == 0:
+            break
+        for a in articles:
+            if a['id'] in known:
+                run += 1
+            elif a['id'] not in new: # articles published while walking shift the pages, listing some twice
+                run = 0
+                new[a['id']] = a['url']
+    print('%s: %i new articles in %i pages'%(country, len(new), page))
+    return new
+
+# Incremental crawl: scrapes only the articles published since the last run and appends them to the editions' JSON Lines files,
+# without retrieving all urls again (retrieve_urls() and clean_duplicates() are only needed for a full crawl)
+# The index of known ids starts from the articles already scraped
+def update_articles():
+    index = KnownIndex(index_out())
+    corpus = CorpusStore(corpus_out(), batch_size=100)
+    for c in c_name:
+        out = 'data/articlesEdition/articles_%s.jsonl'%c
+        known = index.known(c)
+        if len(known) == 0 and os.path.exists(out):
+            index.add(c, [a['id'] for a in read_jsonl(out)])
+            known = index.known(c)
+        new = new_articles_urls(c, known)
+        with JSONLinesSink(out) as sink:
+            corpus.upsert_articles(saved_articles(list(new.values()), c, sink, index))
+            print('Found %i articles'%sink.count)
+    index.close()
+    corpus.close()
+    get_fetcher().report()
+    article_dates.report('article dates')
 
 # scrap_articles()
\ No newline at end of file